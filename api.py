@@ -1,13 +1,39 @@
 from aiohttp import web
 
+from bot import chapter_builds
+from plugins.client import MangaClient
+from tools import connector, retry
+from tools.flood import rate_limiter
+from tools.http_cache import revalidation_cache
+from tools.jobs import job_queue
+from tools.page_cache import page_cache
+from tools.scheduler import download_scheduler
+from tools.workers import conversion_pool
+
 
 async def root_handler(request):
     return web.json_response({"status": "Online"})
 
 
+async def stats_handler(request):
+    return web.json_response({
+        "chapter_builds": chapter_builds.stats(),
+        "conversions": conversion_pool.stats(),
+        "connections": connector.stats(),
+        "downloads": download_scheduler.stats(),
+        "page_cache": page_cache.stats(),
+        "jobs": job_queue.stats(),
+        "in_flight_requests": MangaClient.in_flight.stats(),
+        "retries": retry.stats(),
+        "revalidation": revalidation_cache.stats(),
+        "search_cache": MangaClient.search_cache.stats(),
+        "telegram": rate_limiter.stats(),
+    })
+
+
 async def run_web_server():
     app = web.Application()
-    app.add_routes([web.get("/", root_handler)])
+    app.add_routes([web.get("/", root_handler), web.get("/stats", stats_handler)])
     runner = web.AppRunner(app)
     await runner.setup()
     PORT = 3000
@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image
+
+from img2all.core import stream2all
+from img2cbz.core import fld2cbz
+from img2pdf.core import fld2pdf, make_thumb, page_files
+from tools.workers import conversion_pool
+
+# (extension, save options, mode, page size)
+FORMATS = {
+    'jpeg': ('jpg', {'quality': 90}, 'RGB', (900, 1300)),
+    'png': ('png', {}, 'RGB', (900, 1300)),
+    'webp': ('webp', {'quality': 90}, 'RGB', (900, 1300)),
+    'gray': ('jpg', {'quality': 90}, 'L', (900, 1300)),
+    'cmyk': ('jpg', {'quality': 90}, 'CMYK', (900, 1300)),
+    'webtoon': ('jpg', {'quality': 90}, 'RGB', (800, 12000)),
+}
+
+TASKS = ['fld2pdf', 'fld2cbz', 'make_thumb', 'stream2all']
+
+
+# a smooth gradient with some noise on top: compresses like a scanned page rather than like flat color or pure noise
+def make_page(mode: str, size, seed: int) -> Image.Image:
+    noise = Image.effect_noise(size, 24 + seed % 16)
+    gradient = Image.linear_gradient('L').resize(size)
+    base = Image.blend(gradient, noise, 0.35)
+    if mode == 'L':
+        return base
+    channels = [base, base.rotate(180), noise]
+    if mode == 'CMYK':
+        channels.append(gradient.transpose(Image.FLIP_LEFT_RIGHT))
+    return Image.merge(mode, channels)
+
+
+def make_chapter(folder: Path, fmt: str, pages: int):
+    ext, options, mode, size = FORMATS[fmt]
+    folder.mkdir(parents=True, exist_ok=True)
+    for i in range(pages):
+        with make_page(mode, size, i) as page:
+            page.save(folder / f'{format(i, "05d")}.{ext}', **options)
+
+
+def clean_outputs(folder: Path):
+    shutil.rmtree(folder / 'thumbnail', ignore_errors=True)
+    for file in folder.glob('bench*'):
+        file.unlink()
+
+
+# peak resident set size of this process in MB. VmHWM starts over in a new process, ru_maxrss is inherited from
+# the parent on linux and would report the benchmark's own peak
+def peak_rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb(pid) -> float:
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0
+
+
+# highest RSS of this process and the conversion pool workers together, sampled while `running` is set
+def sample_pool_rss(running: threading.Event, peak: list):
+    while running.is_set():
+        executor = conversion_pool._executor
+        pids = ['self'] + list(getattr(executor, '_processes', None) or {})
+        peak[0] = max(peak[0], sum(rss_mb(pid) for pid in pids))
+        time.sleep(0.005)
+
+
+async def pages(files):
+    for file in files:
+        yield file
+
+
+# packages `chapters` copies of the chapter at the same time, the way the bot does with several job workers
+async def stream_chapters(folder: Path, webtoon: bool, chapters: int):
+    files = page_files(folder)
+    results = await asyncio.gather(*(
+        stream2all(pages(files), folder, f'bench-{i}', webtoon=webtoon, pages=len(files),
+                   thumb_path=folder / 'thumbnail' / f'bench-{i}.jpg')
+        for i in range(chapters)
+    ))
+    return [output for result in results for output in result if output]
+
+
+# runs in a fresh process, so the peak RSS belongs to this task alone. stream2all also counts its pool workers
+def run_task(task: str, folder: str, webtoon: bool, workers: int = None, chapters: int = 1):
+    folder = Path(folder)
+    clean_outputs(folder)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    peak = [0.0]
+    if task == 'stream2all':
+        conversion_pool.workers = workers
+        running = threading.Event()
+        running.set()
+        sampler = threading.Thread(target=sample_pool_rss, args=(running, peak))
+        sampler.start()
+        try:
+            outputs = asyncio.run(stream_chapters(folder, webtoon, chapters))
+        finally:
+            running.clear()
+            sampler.join()
+            conversion_pool.shutdown()
+    elif task == 'fld2pdf':
+        outputs = fld2pdf(folder, 'bench', webtoon)
+    elif task == 'fld2cbz':
+        outputs = [fld2cbz(folder, 'bench')]
+    else:
+        outputs = [make_thumb(folder, page_files(folder))]
+    wall = time.perf_counter() - start
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    result = {
+        'wall': wall,
+        'cpu': (end.ru_utime - usage.ru_utime) + (end.ru_stime - usage.ru_stime),
+        'peak_rss_mb': max(peak_rss_mb(), peak[0]),
+        'output_bytes': sum(Path(output).stat().st_size for output in outputs),
+    }
+    clean_outputs(folder)
+    return result
+
+
+def measure(task: str, folder: Path, webtoon: bool, repeat: int, workers: int = None, chapters: int = 1):
+    runs = []
+    context = multiprocessing.get_context('spawn')
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            runs.append(executor.submit(run_task, task, str(folder), webtoon, workers, chapters).result())
+    return {
+        'wall': statistics.median(run['wall'] for run in runs),
+        'cpu': statistics.median(run['cpu'] for run in runs),
+        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+        'output_bytes': runs[-1]['output_bytes'],
+    }
+
+
+def compare(results, baseline, threshold: float) -> bool:
+    baseline = {case['case']: case for case in baseline['results']}
+    regressed = False
+    for case in results:
+        before = baseline.get(case['case'])
+        if not before:
+            continue
+        for metric in ('wall', 'peak_rss_mb', 'output_bytes'):
+            if before[metric] and case[metric] > before[metric] * (1 + threshold):
+                regressed = True
+                print(f'REGRESSION {case["case"]} {metric}: {before[metric]:.2f} -> {case[metric]:.2f}')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure fld2pdf, fld2cbz, make_thumb and stream2all on synthetic '
+                                                 'chapters.')
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--pages', default='10,40')
+    parser.add_argument('--tasks', default=','.join(TASKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, help='conversion pool workers for stream2all, defaults to the cpu count')
+    parser.add_argument('--chapters', type=int, default=1, help='chapters stream2all packages at the same time')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative increase over the earlier run that counts as a regression')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='conversion-bench-') as tmp:
+        for fmt in args.formats.split(','):
+            for pages in map(int, args.pages.split(',')):
+                folder = Path(tmp) / f'{fmt}-{pages}'
+                make_chapter(folder, fmt, pages)
+                for task in args.tasks.split(','):
+                    result = measure(task, folder, fmt == 'webtoon', args.repeat, args.workers, args.chapters)
+                    result.update(case=f'{task}/{fmt}/{pages}', task=task, format=fmt, pages=pages)
+                    results.append(result)
+                    print(f'{result["case"]:<26} wall {result["wall"] * 1000:8.1f} ms  cpu {result["cpu"] * 1000:8.1f} ms'
+                          f'  peak rss {result["peak_rss_mb"]:7.1f} MB  output {result["output_bytes"] / 1024:9.1f} KB')
+                shutil.rmtree(folder)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({'results': results}, indent=2))
+    if args.compare and compare(results, json.loads(Path(args.compare).read_text()), args.threshold):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from plugins.search_engine import SearchIndex, search
+
+WORDS = ['one', 'piece', 'tower', 'of', 'god', 'solo', 'leveling', 'the', 'king', 'hero', 'return', 'academy',
+         'demon', 'slayer', 'dragon', 'ball', 'night', 'sword', 'master', 'world', 'love', 'school', 'magic',
+         'legend', 'northern', 'blade', 'martial', 'peak', 'villain', 'reincarnated', 'a', 'in', 'my', 'life']
+
+QUERIES = ['one piece', 'tower of god', 'solo leveling', 'the', 'demon king academy', 'martial peak',
+           'reincarnated as a villain', 'xq', 'sword master', 'a']
+
+
+def random_word(rng: random.Random):
+    if rng.random() < 0.7:
+        return rng.choice(WORDS)
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+
+
+def make_catalog(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(count):
+        name = ' '.join(random_word(rng) for _ in range(rng.randint(1, 5))).title()
+        alt_names = [' '.join(random_word(rng) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(0, 3))]
+        documents.append({'i': name.replace(' ', '-'), 's': name, 'a': alt_names})
+    return documents
+
+
+def get_title(doc):
+    return doc['i']
+
+
+def get_text(doc):
+    return doc['s'] + ' ' + ' '.join(doc['a'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the linear search scan with the search index.')
+    parser.add_argument('--documents', type=int, default=30000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    documents = make_catalog(args.documents)
+
+    start = time.perf_counter()
+    index = SearchIndex(documents, get_title, get_text)
+    build = time.perf_counter() - start
+
+    linear_time = indexed_time = 0
+    for _ in range(args.repeat):
+        for query in QUERIES:
+            start = time.perf_counter()
+            expected = search(query, documents, get_title, get_text)[:args.limit]
+            linear_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = index.search(query, limit=args.limit)
+            indexed_time += time.perf_counter() - start
+
+            if results != expected:
+                raise SystemExit(f'Results differ for query {query!r}')
+
+    queries = args.repeat * len(QUERIES)
+    print(f'documents: {len(documents)}, index build: {build * 1000:.1f} ms')
+    print(f'linear scan: {linear_time / queries * 1000:.2f} ms/query')
+    print(f'index:       {indexed_time / queries * 1000:.2f} ms/query')
+    print(f'speedup:     {linear_time / indexed_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import enum
+import hashlib
 import shutil
 from ast import arg
 import asyncio
@@ -11,8 +12,8 @@ import json
 import pyrogram.errors
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaDocument
 
-from img2cbz.core import fld2cbz
-from img2pdf.core import fld2pdf
+from img2all.core import stream2all
+from img2pdf.core import CHAPTER_BYTE_BUDGET, DEFAULT_PROFILE
 from img2tph.core import img2tph
 from plugins import MangaClient, ManhuaKoClient, MangaCard, MangaChapter, ManhuaPlusClient, TMOClient, MangaDexClient, \
     MangaSeeClient, MangasInClient, McReaderClient, MangaKakalotClient, ManganeloClient, ManganatoClient, \
@@ -22,12 +23,15 @@ import os
 from loguru import logger
 from pyrogram import Client, filters
 from pyromod import listen
-from typing import Dict, Tuple, List, TypedDict
+from typing import Dict, Tuple, List, Set, TypedDict
 
 from models.db import DB, ChapterFile, Subscription, LastChapter, MangaName, MangaOutput
 from pagination import Pagination
 from plugins.client import clean
 from tools.flood import retry_on_flood
+from tools.jobs import job_queue
+from tools.scheduler import Priority
+from tools.singleflight import SingleFlight
 
 mangas: Dict[str, MangaCard] = dict()
 chapters: Dict[str, MangaChapter] = dict()
@@ -39,10 +43,10 @@ all_pages: Dict[str, MangaCard] = dict()
 favourites: Dict[str, MangaCard] = dict()
 language_query: Dict[str, Tuple[str, str]] = dict()
 users_in_channel: Dict[int, dt.datetime] = dict()
-locks: Dict[int, asyncio.Lock] = dict()
 file_options: Dict[str, int] = dict(pdf=147483641, cbz=2147483642, both=2147483643)
 manga_thumbs: Dict[str, str] = dict()
 bulk_process: List[str] = list()
+bulk_uploads: Set[asyncio.Task] = set()
 
 plugin_dicts: Dict[str, Dict[str, MangaClient]] = {
     "🇬🇧 EN": {
@@ -71,9 +75,6 @@ plugin_dicts: Dict[str, Dict[str, MangaClient]] = {
     }
 }
 
-cache_dir = "cache"
-if os.path.exists(cache_dir):
-    shutil.rmtree(cache_dir)
 with open("tools/help_message.txt", "r") as f:
     help_msg = f.read()
 
@@ -359,7 +360,7 @@ async def language_click(client, callback: CallbackQuery):
 
 async def plugin_click(client, callback: CallbackQuery):
     manga_client, query = queries[callback.data]
-    results = await manga_client.search(query)
+    results = await manga_client.cached_search(query)
     if not results:
         await bot.send_message(callback.from_user.id, "No manga found for given query.")
         return
@@ -440,111 +441,187 @@ async def manga_click(client, callback: CallbackQuery, pagination: Pagination =
         )
 
 
-async def chapter_click(client, data, chat_id, chapter=None, custom_caption=None, custom_filename=None, Id=None):
+# chapter files are cached per chapter url and output variant: the default variant is stored under the chapter url
+# itself, others (custom file names, output profiles, byte budgets) under the url followed by a hash of the variant
+def chapter_file_key(chapter_url: str, custom_filename: str = None) -> str:
+    variant = []
+    if custom_filename:
+        variant.append(f'filename={custom_filename}')
+    if DEFAULT_PROFILE.name != 'original':
+        variant.append(f'profile={DEFAULT_PROFILE.name}')
+    if CHAPTER_BYTE_BUDGET:
+        variant.append(f'budget={CHAPTER_BYTE_BUDGET}')
+    if not variant:
+        return chapter_url
+    return f'{chapter_url}|{hashlib.sha1("&".join(variant).encode()).hexdigest()[:16]}'
+
+
+class ChapterBuildError(Exception):
+    pass
+
+
+chapter_builds = SingleFlight()
+
+
+def missing_formats(chapterFile: ChapterFile, options: int):
+    return [option for option, stored in ((OutputOptions.PDF, chapterFile and chapterFile.file_id),
+                                          (OutputOptions.CBZ, chapterFile and chapterFile.cbz_id),
+                                          (OutputOptions.Telegraph, chapterFile and chapterFile.telegraph_url))
+            if options & option and not stored]
+
+
+# only the formats the chat asked for and that are not stored yet are built, formats that are still missing (empty)
+# in the stored row are filled in when some chat asks for them
+async def build_chapter_file(chapter: MangaChapter, chapter_key: str, options: int, cache_channel,
+                             custom_filename: str = None, priority: int = Priority.INTERACTIVE) -> ChapterFile:
+    db = DB()
+    # read again, a build that finished while this one was waiting may have stored some of the formats
+    chapterFile = await db.get(ChapterFile, chapter_key)
+    missing = missing_formats(chapterFile, options)
+    build_pdf = OutputOptions.PDF in missing
+    build_cbz = OutputOptions.CBZ in missing
+    build_telegraph = OutputOptions.Telegraph in missing
+
+    caption = '\n'.join([
+        f'{chapter.manga.name} - {chapter.name}',
+        f'{chapter.get_url()}'
+    ])
+
+    if build_pdf or build_cbz or build_telegraph:
+        if not chapter.pictures:
+            await chapter.client.set_pictures(chapter)
+        if not chapter.pictures:
+            raise ChapterBuildError(f'There was an error parsing this chapter or chapter is missing' +
+                                    f', please check the chapter at the web\n\n{caption}')
+        if not chapterFile:
+            chapterFile = ChapterFile(url=chapter_key, file_id='', file_unique_id='', cbz_id='', cbz_unique_id='',
+                                      telegraph_url='')
+
+        pictures_folder = chapter.client.pictures_folder(chapter, chapter_key)
+        try:
+            if build_pdf or build_cbz:
+                if chapter.client.name == "Manhwa18":
+                    ch_name = clean(f'{chapter.name.replace("Chapter", "Ch -").strip()} {clean(chapter.manga.name, 25)}', 40) + ' @Adult_Mangas'
+                else:
+                    ch_name = custom_filename or "{chapter_title} {manga_title}"
+                    ch_name = ch_name.format(
+                        chapter_title=chapter.name.replace("Chapter", "Ch -"),
+                        manga_title=clean(chapter.manga.name, 36),
+                    )
+
+                try:
+                    pdf, cbz, thumb_path = await stream2all(chapter.client.iter_pictures(chapter, priority,
+                                                                                         build_key=chapter_key),
+                                                            pictures_folder, ch_name, pdf=bool(build_pdf),
+                                                            cbz=bool(build_cbz), webtoon=chapter.client.webtoon,
+                                                            pages=len(chapter.pictures),
+                                                            thumb_path=chapter.client.thumbnail_path(chapter.manga))
+                except Exception as e:
+                    print(f'Error creating pdf for {chapter.name} - {chapter.manga.name}\n{e!r}')
+                    raise ChapterBuildError(f'There was an error making the pdf for this chapter. '
+                                            f'Please contact the developer with the name of the manga'
+                                            f' and the chapter number.')
+
+            if build_telegraph:
+                chapterFile.telegraph_url = await img2tph(chapter, clean(f'{chapter.manga.name} {chapter.name}'))
+
+            if build_pdf or build_cbz:
+                files = [file for file in (pdf, cbz) if file]
+                if len(files) == 1:
+                    messages = [await retry_on_flood(bot.send_document)(cache_channel, files[0], thumb=thumb_path,
+                                                                        caption=f'{chapterFile.telegraph_url}')]
+                else:
+                    messages: List[Message] = await retry_on_flood(bot.send_media_group)(cache_channel, [
+                        InputMediaDocument(pdf, thumb=thumb_path),
+                        InputMediaDocument(cbz, thumb=thumb_path, caption=f'{chapterFile.telegraph_url}')
+                    ])
+
+                messages = iter(messages)
+                if build_pdf:
+                    pdf_m = next(messages)
+                    chapterFile.file_id, chapterFile.file_unique_id = pdf_m.document.file_id, pdf_m.document.file_unique_id
+                if build_cbz:
+                    cbz_m = next(messages)
+                    chapterFile.cbz_id, chapterFile.cbz_unique_id = cbz_m.document.file_id, cbz_m.document.file_unique_id
+        finally:
+            # the folder holds links to page cache blobs, left behind it would keep evicted pages on disk
+            shutil.rmtree(pictures_folder, ignore_errors=True)
+
+        await db.add(chapterFile)
+
+    return chapterFile
+
+
+async def chapter_click(client, data, chat_id, chapter=None, custom_caption=None, custom_filename=None, Id=None,
+                        priority: int = None):
     if Id and Id not in bulk_process:
         return
-    lock = locks.get(chat_id)
-    if not lock:
-        locks[chat_id] = asyncio.Lock()
+    cache_channel = env_vars.get("CACHE_CHANNEL")
+    if not cache_channel:
+        return await bot.send_message(chat_id, "Bot cache channel is not configured correctly.")
 
-    async with locks[chat_id]:
-        cache_channel = env_vars.get("CACHE_CHANNEL")
-        if not cache_channel:
-            return await bot.send_message(chat_id, "Bot cache channel is not configured correctly.")
+    # Try convert to int cache_channel, because it can be id or username
+    try:
+        cache_channel = int(cache_channel)
+    except ValueError:
+        pass 
+    
+    if not chapter:
+        chapter = chapters[data]
 
-        # Try convert to int cache_channel, because it can be id or username
-        try:
-            cache_channel = int(cache_channel)
-        except ValueError:
-            pass 
-        
-        if not chapter:
-            chapter = chapters[data]
-
-        db = DB()
-
-        chapterFile = None #await db.get(ChapterFile, chapter.url) if not custom_filename else None
-        options = await db.get(MangaOutput, str(chat_id))
-        options = options.output if options else (1 << 30) - 1
-
-        caption = '\n'.join([
-            f'{chapter.manga.name} - {chapter.name}',
-            f'{chapter.get_url()}'
-        ])
-
-        download = not chapterFile
-        download = download or options & OutputOptions.PDF and not chapterFile.file_id
-        download = download or options & OutputOptions.CBZ and not chapterFile.cbz_id
-        download = download or options & OutputOptions.Telegraph and not chapterFile.telegraph_url
-        download = download and options & ((1 << len(OutputOptions)) - 1) != 0
-
-        if download:
-            pictures_folder = await chapter.client.download_pictures(chapter)
-            if not chapter.pictures:
-                return await bot.send_message(chat_id, f'There was an error parsing this chapter or chapter is missing' +
-                                              f', please check the chapter at the web\n\n{caption}')
-            if chapter.client.name == "Manhwa18":
-                ch_name = clean(f'{chapter.name.replace("Chapter", "Ch -").strip()} {clean(chapter.manga.name, 25)}', 40) + ' @Adult_Mangas'
-            else:
-                ch_name = custom_filename or "{chapter_title} {manga_title}"
-                ch_name = ch_name.format(
-                    chapter_title=chapter.name.replace("Chapter", "Ch -"),
-                    manga_title=clean(chapter.manga.name, 36),
-                )
-
-            try:
-                pdf, thumb_path = fld2pdf(pictures_folder, ch_name)
-            except Exception as e:
-                print(f'Error creating pdf for {chapter.name} - {chapter.manga.name}\n{e}')
-                return await bot.send_message(chat_id, f'There was an error making the pdf for this chapter. '
-                                                       f'Please contact the developer with the name of the manga'
-                                                       f' and the chapter number.')
-                
-            cbz = fld2cbz(pictures_folder, ch_name)
-            telegraph_url = await img2tph(chapter, clean(f'{chapter.manga.name} {chapter.name}'))
-
-            messages: List[Message] = await retry_on_flood(bot.send_media_group)(cache_channel, [
-                InputMediaDocument(pdf, thumb=thumb_path),
-                InputMediaDocument(cbz, thumb=thumb_path, caption=f'{telegraph_url}')
-            ])
-
-            pdf_m, cbz_m = messages
-
-            if not custom_filename and not chapterFile:
-                await db.add(ChapterFile(url=chapter.url, file_id=pdf_m.document.file_id,
-                                         file_unique_id=pdf_m.document.file_unique_id, cbz_id=cbz_m.document.file_id,
-                                         cbz_unique_id=cbz_m.document.file_unique_id, telegraph_url=telegraph_url))
-            elif not custom_filename:
-                chapterFile.file_id, chapterFile.file_unique_id, chapterFile.cbz_id, \
-                chapterFile.cbz_unique_id, chapterFile.telegraph_url = \
-                    pdf_m.document.file_id, pdf_m.document.file_unique_id, cbz_m.document.file_id, \
-                    cbz_m.document.file_unique_id, telegraph_url
-                #await db.add(chapterFile)
-
-            shutil.rmtree(pictures_folder)
-        
-        #chapterFile = await db.get(ChapterFile, chapter.url) if not custom_filename else ChapterFile()
-        if download:
-            chapterFile.telegraph_url, chapterFile.file_id, chapterFile.cbz_id = telegraph_url, pdf_m.document.file_id, cbz_m.document.file_id
-
-        caption = f'{chapter.name.replace("Chapter", "Ch-")} - {chapter.manga.name}\n' if not str(chat_id).startswith('-100') else (custom_caption or "").format(chapter_title=chapter.name, manga_title=chapter.manga.name)
-        if options & OutputOptions.Telegraph:
-            caption += f'[Read on telegraph]({chapterFile.telegraph_url})\n'
-        caption += f'[Read on website]({chapter.get_url()})' if  not str(chat_id).startswith('-100') else ''
-        media_docs = []
-        if options & OutputOptions.PDF:
-            media_docs.append(InputMediaDocument(chapterFile.file_id))
-        if options & OutputOptions.CBZ:
-            media_docs.append(InputMediaDocument(chapterFile.cbz_id))
-
-        if len(media_docs) == 0:
-            await retry_on_flood(bot.send_message)(chat_id, caption)
-        elif len(media_docs) == 1:
-            await retry_on_flood(bot.send_document)(chat_id, media_docs[0].media, caption=caption)
-        else:
-            media_docs[-1].caption = caption
-            await retry_on_flood(bot.send_media_group)(chat_id, media_docs)
-        await asyncio.sleep(1)
+    db = DB()
+
+    chapter_key = chapter_file_key(chapter.url, custom_filename)
+    chapterFile = await db.get(ChapterFile, chapter_key)
+    options = await db.get(MangaOutput, str(chat_id))
+    options = options.output if options else (1 << 30) - 1
+
+    if priority is None:
+        priority = Priority.BULK if Id else Priority.INTERACTIVE
+
+    # concurrent requests for the same chapter file share one build. a build started for other formats
+    # can finish without the ones this chat needs, the loop then builds those
+    try:
+        while missing_formats(chapterFile, options):
+            chapterFile = await chapter_builds.do(chapter_key, lambda: build_chapter_file(
+                chapter, chapter_key, options, cache_channel, custom_filename, priority))
+    except ChapterBuildError as e:
+        return await bot.send_message(chat_id, str(e))
+
+    caption = f'{chapter.name.replace("Chapter", "Ch-")} - {chapter.manga.name}\n' if not str(chat_id).startswith('-100') else (custom_caption or "").format(chapter_title=chapter.name, manga_title=chapter.manga.name)
+    if options & OutputOptions.Telegraph:
+        caption += f'[Read on telegraph]({chapterFile.telegraph_url})\n'
+    caption += f'[Read on website]({chapter.get_url()})' if  not str(chat_id).startswith('-100') else ''
+    media_docs = []
+    if options & OutputOptions.PDF:
+        media_docs.append(InputMediaDocument(chapterFile.file_id))
+    if options & OutputOptions.CBZ:
+        media_docs.append(InputMediaDocument(chapterFile.cbz_id))
+
+    if len(media_docs) == 0:
+        await retry_on_flood(bot.send_message)(chat_id, caption)
+    elif len(media_docs) == 1:
+        await retry_on_flood(bot.send_document)(chat_id, media_docs[0].media, caption=caption)
+    else:
+        media_docs[-1].caption = caption
+        await retry_on_flood(bot.send_media_group)(chat_id, media_docs)
+
+
+def log_job_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception():
+        print(f'Error delivering chapter: {future.exception()!r}')
+
+
+# chapter deliveries run on the job queue, fairly between users instead of inline in the handler
+def enqueue_chapter(user_id, priority: int, *args, group=None, **kwargs) -> asyncio.Future:
+    future = job_queue.submit(user_id, lambda: chapter_click(*args, priority=priority, **kwargs), priority, group)
+    future.add_done_callback(log_job_error)
+    return future
+
+
+async def send_manga_chapter(client, data, chat_id):
+    return await job_queue.run(chat_id, lambda: chapter_click(client, data, chat_id, priority=Priority.SUBSCRIPTION),
+                               Priority.SUBSCRIPTION)
 
 
 async def pagination_click(client: Client, callback: CallbackQuery):
@@ -557,11 +634,7 @@ async def pagination_click(client: Client, callback: CallbackQuery):
 async def full_page_click(client: Client, callback: CallbackQuery):
     chapters_data = full_pages[callback.data]
     for chapter_data in reversed(chapters_data):
-        try:
-            await chapter_click(client, chapter_data, callback.from_user.id)
-        except Exception as e:
-            print(e)
-        await asyncio.sleep(0.5)
+        enqueue_chapter(callback.from_user.id, Priority.INTERACTIVE, client, chapter_data, callback.from_user.id)
 
 async def all_page_click(client: Client, callback: CallbackQuery):
     manga = all_pages[callback.data]
@@ -611,24 +684,37 @@ async def all_page_click(client: Client, callback: CallbackQuery):
     if Id not in bulk_process:
         bulk_process.append(Id)
 
-    all_chapters = [chapter async for chapter in manga.client.iter_chapters(manga.url, manga.name)]
-    for chapter in reversed(all_chapters):
-        if Id not in bulk_process:
-            await status_message.edit_text('<b>Upload Cancelled!</b>\n\n' + details, reply_markup=None)
-            return
-            
-        try:
-            await chapter_click(client, None, chat_id, chapter, custom_filename=custom_filename, Id=Id)
-        except Exception as e:
-            print(e)
-        await asyncio.sleep(1)
-    
-    if Id in bulk_process:
-        bulk_process.remove(Id)
+    # the upload runs in the background, the handler returns as soon as it is queued
+    task = asyncio.ensure_future(bulk_upload(client, callback.from_user.id, manga, chat_id, custom_filename, Id,
+                                             status_message, details))
+    bulk_uploads.add(task)
+    task.add_done_callback(bulk_uploads.discard)
+    task.add_done_callback(log_job_error)
+
+
+async def bulk_upload(client: Client, user_id: int, manga: MangaCard, chat_id: int, custom_filename: str, Id: str,
+                      status_message: Message, details: str):
+    try:
+        all_chapters = [chapter async for chapter in manga.client.iter_chapters(manga.url, manga.name)]
+        jobs = [enqueue_chapter(user_id, Priority.BULK, client, None, chat_id, chapter,
+                                custom_filename=custom_filename, Id=Id, group=Id)
+                for chapter in reversed(all_chapters)]
+        await asyncio.gather(*jobs, return_exceptions=True)
+    except Exception:
+        if Id in bulk_process:
+            bulk_process.remove(Id)
+        await status_message.edit_text('<b>Upload Failed!</b>\n\n' + details, reply_markup=None)
+        raise
+
+    if Id not in bulk_process:
+        await status_message.edit_text('<b>Upload Cancelled!</b>\n\n' + details, reply_markup=None)
+        return
+    bulk_process.remove(Id)
     await status_message.edit_text('<b>Upload Finished!</b>\n\n' + details, reply_markup=None)
 
 async def bulk_process_click(client: Client, callback: CallbackQuery):
     bulk_process.remove(callback.data)
+    job_queue.cancel_group(callback.data)
     await callback.answer("Upload will be cancelled soon!", show_alert=True)
 
 async def favourite_click(client: Client, callback: CallbackQuery):
@@ -683,10 +769,7 @@ async def on_callback_query(client, callback: CallbackQuery):
     elif callback.data in mangas:
         await manga_click(client, callback)
     elif callback.data in chapters:
-        try:
-            await chapter_click(client, callback.data, callback.from_user.id)
-        except BaseException:
-            await chapter_click(client, callback.data, callback.from_user.id)
+        enqueue_chapter(callback.from_user.id, Priority.INTERACTIVE, client, callback.data, callback.from_user.id)
     elif callback.data in full_pages:
         await full_page_click(client, callback)
     elif callback.data in all_pages:
@@ -815,19 +898,16 @@ async def update_mangas():
     for url, chapter_list in updated.items():
         for chapter in chapter_list:
             logger.debug(f'Updating {chapter.manga.name} - {chapter.name}')
-            for sub in subs_dictionary[url]:
-                if sub in blocked:
-                    continue
-                try:
-                    await send_manga_chapter(bot, chapter.unique(), int(sub))
-                except pyrogram.errors.UserIsBlocked:
+            subs = [sub for sub in subs_dictionary[url] if sub not in blocked]
+            results = await asyncio.gather(*(send_manga_chapter(bot, chapter.unique(), int(sub)) for sub in subs),
+                                           return_exceptions=True)
+            for sub, result in zip(subs, results):
+                if isinstance(result, pyrogram.errors.UserIsBlocked):
                     logger.info(f'User {sub} blocked the bot')
                     await remove_subscriptions(sub)
                     blocked.add(sub)
-                except BaseException as e:
-                    logger.exception(f'An exception occurred sending new chapter: {e}')
-                await asyncio.sleep(0.5)
-            await asyncio.sleep(1)
+                elif isinstance(result, BaseException):
+                    logger.opt(exception=result).error(f'An exception occurred sending new chapter: {result}')
 
 
 async def manga_updater():
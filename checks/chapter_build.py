@@ -0,0 +1,175 @@
+import asyncio
+import io
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import suppress
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parent.parent
+WORK = Path(tempfile.gettempdir()) / 'chapter-build-check'
+sys.path.insert(0, str(ROOT))
+# before the page cache is imported, so the check never touches the bot's own
+os.environ['PAGE_CACHE_DIR'] = str(WORK / 'page_cache')
+
+from aiohttp import web
+from PIL import Image
+
+from models.db import DB, ChapterFile, MangaOutput
+from plugins.client import MangaCard, MangaChapter, MangaClient
+from tools.workers import conversion_pool
+
+PORT = 8799
+CACHE_CHANNEL = -1001
+
+
+# a chapter from the local site, every page a different color so none comes from the page cache of another.
+# the pages of chapter 'missing' are not found
+class LocalClient(MangaClient):
+
+    def __init__(self):
+        super().__init__(name='chapter-build-check')
+
+    def chapter(self, number, pages: int = 4) -> MangaChapter:
+        manga = MangaCard(self, 'Check', f'http://127.0.0.1:{PORT}/manga', '')
+        return MangaChapter(self, f'Chapter {number}', f'http://127.0.0.1:{PORT}/chapter/{number}', manga,
+                            [f'http://127.0.0.1:{PORT}/{number}/{page}.jpg' for page in range(pages)])
+
+    async def search(self, query: str = "", page: int = 1):
+        return []
+
+    async def get_chapters(self, manga_card: MangaCard, page: int = 1):
+        return []
+
+    async def iter_chapters(self, manga_url: str, manga_name):
+        yield
+
+    async def contains_url(self, url: str):
+        return False
+
+    async def pictures_from_chapters(self, content: bytes, response=None):
+        return []
+
+    async def updates_from_page(self, content: bytes):
+        return {}
+
+    async def check_updated_urls(self, last_chapters):
+        return [], []
+
+
+async def picture(request):
+    if request.match_info['chapter'] == 'missing':
+        return web.Response(status=404)
+    buffer = io.BytesIO()
+    color = (int(request.match_info['chapter']) * 40 % 256, int(request.match_info['page']) * 40 % 256, 120)
+    Image.new('RGB', (400, 600), color).save(buffer, format='JPEG')
+    return web.Response(body=buffer.getvalue(), content_type='image/jpeg')
+
+
+# stands in for the telegram api: records what is sent and answers with made up file ids
+class FakeTelegram:
+
+    def __init__(self):
+        self.sent = []
+        self.ids = itertools.count()
+
+    def message(self):
+        i = next(self.ids)
+        return SimpleNamespace(document=SimpleNamespace(file_id=f'file-{i}', file_unique_id=f'unique-{i}'))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.sent.append((chat_id, [document]))
+        return self.message()
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        self.sent.append((chat_id, [item.media for item in media]))
+        return [self.message() for _ in media]
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    def to(self, chat_id):
+        return [content for chat, content in self.sent if chat == chat_id]
+
+
+def check(condition: bool, message: str, failures: list):
+    print(f'{"ok  " if condition else "FAIL"} {message}')
+    if not condition:
+        failures.append(message)
+
+
+# runs chapter builds on a cache miss through to the send, against a local site and a stand in for telegram
+async def run_checks(bot_module, client: LocalClient) -> list:
+    failures = []
+    telegram = FakeTelegram()
+    bot = bot_module.bot
+    bot.send_document, bot.send_media_group, bot.send_message = \
+        telegram.send_document, telegram.send_media_group, telegram.send_message
+    bot_module.env_vars['CACHE_CHANNEL'] = str(CACHE_CHANNEL)
+
+    db = DB()
+    await db.connect()
+    for chat_id in (1, 2):
+        await db.add(MangaOutput(user_id=str(chat_id), output=3))  # pdf and cbz
+
+    # two chats ask for the same uncached chapter at once, they share one build
+    chapter = client.chapter(1)
+    await asyncio.gather(*(bot_module.chapter_click(client, None, chat_id, chapter=chapter) for chat_id in (1, 2)))
+    stored = await db.get(ChapterFile, chapter.url)
+    check(stored is not None and bool(stored.file_id and stored.cbz_id), 'the build is stored', failures)
+    check(len(telegram.to(CACHE_CHANNEL)) == 1, 'the chapter is uploaded to the cache channel once', failures)
+    for chat_id in (1, 2):
+        check(telegram.to(chat_id) == [[stored.file_id, stored.cbz_id]] if stored else False,
+              f'chat {chat_id} gets the stored pdf and cbz', failures)
+
+    # a cached chapter is sent again without a build
+    await bot_module.chapter_click(client, None, 1, chapter=client.chapter(1))
+    check(len(telegram.to(CACHE_CHANNEL)) == 1 and len(telegram.to(1)) == 2,
+          'a cached chapter is sent without uploading it again', failures)
+
+    # a build that fails tells the chat and leaves no working folder behind
+    await bot_module.chapter_click(client, None, 2, chapter=client.chapter('missing'))
+    check(len(telegram.to(2)) == 2 and isinstance(telegram.to(2)[-1], str), 'a failed build is reported', failures)
+    check(not list((ROOT / 'cache' / client.name / 'Check').glob('*')), 'no chapter folder is left behind', failures)
+    return failures
+
+
+def main():
+    shutil.rmtree(WORK, ignore_errors=True)
+    WORK.mkdir(parents=True)
+    DB(f'sqlite:///{WORK / "check.db"}')
+    # bot.py reads its help message and env.json relative to the repository
+    os.chdir(ROOT)
+    import bot
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/{chapter}/{page}.jpg', picture)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', PORT).start()
+        client = LocalClient()
+        try:
+            return await run_checks(bot, client)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    try:
+        # the same loop the clients were created on, the way main.py runs the bot
+        failures = asyncio.get_event_loop_policy().get_event_loop().run_until_complete(run())
+    finally:
+        conversion_pool.shutdown()
+        shutil.rmtree(WORK, ignore_errors=True)
+        shutil.rmtree(ROOT / 'cache' / 'chapter-build-check', ignore_errors=True)
+        with suppress(OSError):
+            (ROOT / 'cache').rmdir()
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import asyncio
+import os
+from collections import deque
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import AsyncIterable, List, Optional, Tuple
+
+from PIL import Image
+
+from img2cbz.core import CbzWriter
+from img2pdf.core import CHAPTER_BYTE_BUDGET, DEFAULT_PROFILE, ByteBudget, OutputProfile, PdfWriter, \
+    is_webtoon_file, pdf_pages, profile_bytes, save_thumb
+from tools.workers import conversion_pool
+
+# PIL decodes a webtoon strip in full before it can be tiled, and a strip is many pages worth of pixels. a chapter
+# converts one strip at a time, and at most STRIP_DECODE_LIMIT strips are converted at once across all chapters
+strip_decodes = asyncio.Semaphore(int(os.environ.get('STRIP_DECODE_LIMIT', 2)))
+
+
+@dataclass
+class Page:
+    name: str
+    data: bytes
+    width: int
+    height: int
+    format: str
+    mode: str
+    pdf_pages: Optional[List[Tuple[bytes, int, int]]] = None
+
+
+# every page is read from disk and decoded once, the same bytes and metadata feed the pdf, the cbz and the thumbnail
+def read_page(path: Path, pdf: bool = True, webtoon: bool = False, profile: OutputProfile = DEFAULT_PROFILE,
+              byte_budget: Optional[int] = None) -> Page:
+    data = path.read_bytes()
+    name = path.name
+    encoded = profile_bytes(data, profile, byte_budget)
+    if encoded is not None:
+        data, name = encoded, f'{path.stem}.jpg'
+    with Image.open(BytesIO(data)) as img:
+        return Page(
+            name=name,
+            data=data,
+            width=img.width,
+            height=img.height,
+            format=img.format,
+            mode=img.mode,
+            pdf_pages=pdf_pages(img, data, webtoon) if pdf else None,
+        )
+
+
+class ChapterPackager:
+
+    def __init__(self, folder: Path, name: str, pdf: bool = True, cbz: bool = True, thumb_path: Path = None):
+        self.folder = folder
+        self.pdf_path = folder / f'{name}.pdf' if pdf else None
+        self.cbz_path = folder / f'{name}.cbz' if cbz else None
+        os.makedirs(folder, exist_ok=True)
+        self.thumb_path = thumb_path or folder / 'thumbnail' / 'thumbnail.jpg'
+        self.pdf = PdfWriter(self.pdf_path) if pdf else None
+        self.cbz = CbzWriter(self.cbz_path) if cbz else None
+        self.first_page: Optional[Page] = None
+        self.thumb_done = self.thumb_path.exists()
+
+    def add_page(self, page: Page):
+        if self.pdf:
+            for jpeg, width, height in page.pdf_pages:
+                self.pdf.add_page(jpeg, width, height)
+        if self.cbz:
+            self.cbz.add_bytes(page.name, page.data)
+        if self.thumb_done:
+            return
+        if self.first_page is None:
+            self.first_page = page
+        else:
+            self.make_thumb(page.width / page.height)
+
+    def make_thumb(self, aspect_ratio: float = 0.7):
+        with Image.open(BytesIO(self.first_page.data)) as img:
+            save_thumb(img, aspect_ratio, self.thumb_path)
+        self.thumb_done = True
+        self.first_page = None
+
+    def abort(self):
+        if self.pdf:
+            self.pdf.abort()
+        if self.cbz:
+            self.cbz.close()
+
+    def close(self):
+        if self.first_page is not None and not self.thumb_done:
+            self.make_thumb()
+        if self.pdf:
+            self.pdf.close()
+        if self.cbz:
+            self.cbz.close()
+        return self.pdf_path, self.cbz_path, self.thumb_path if self.thumb_done else None
+
+
+# packages pages while they are still arriving: up to `window` pages are prepared in the conversion pool at once
+# and they are added to the packager in the order they came in, webtoon strips wait for their turn to be decoded.
+# the byte budget is only applied when the number of pages is known up front
+async def stream2all(files: AsyncIterable[Path], folder: Path, name: str, pdf: bool = True, cbz: bool = True,
+                     webtoon: bool = False, window: int = 8, pages: Optional[int] = None,
+                     profile: OutputProfile = DEFAULT_PROFILE, byte_budget: Optional[int] = CHAPTER_BYTE_BUDGET,
+                     thumb_path: Path = None):
+    packager = ChapterPackager(folder, name, pdf=pdf, cbz=cbz, thumb_path=thumb_path)
+    budget = ByteBudget(byte_budget if pages else None, pages or 0)
+    prepared = deque()
+    strip_lock = asyncio.Lock()
+
+    async def prepare(file: Path, reserved: Optional[int]) -> Page:
+        if webtoon and await asyncio.to_thread(is_webtoon_file, file):
+            async with strip_lock, strip_decodes:
+                return await conversion_pool.run(read_page, file, pdf, webtoon, profile, reserved)
+        return await conversion_pool.run(read_page, file, pdf, webtoon, profile, reserved)
+
+    async def add_next():
+        future, reserved = prepared.popleft()
+        page = await future
+        budget.settle(reserved, len(page.data))
+        await asyncio.to_thread(packager.add_page, page)
+
+    try:
+        async for file in files:
+            reserved = budget.reserve()
+            future = asyncio.ensure_future(prepare(file, reserved))
+            prepared.append((future, reserved))
+            while len(prepared) >= window or (prepared and prepared[0][0].done()):
+                await add_next()
+        while prepared:
+            await add_next()
+    except BaseException:
+        for future, _ in prepared:
+            future.cancel()
+        packager.abort()
+        raise
+    return await asyncio.to_thread(packager.close)
@@ -1,21 +1,78 @@
 import re
+import shutil
+import time
 import zipfile
+import zlib
 from pathlib import Path
-from typing import List
+from typing import BinaryIO, List, Optional, Union
 
+from img2pdf.core import CHAPTER_BYTE_BUDGET, DEFAULT_PROFILE, ByteBudget, OutputProfile, profile_bytes
 
-def fld2cbz(folder: Path, name: str):
+# formats that are already compressed, deflating them costs cpu and saves next to nothing
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.avif'}
+
+
+def fld2cbz(folder: Path, name: str, profile: OutputProfile = DEFAULT_PROFILE,
+            byte_budget: Optional[int] = CHAPTER_BYTE_BUDGET):
     cbz = folder / f'{name}.cbz'
     files = [file for file in folder.glob(r'*') if re.match(r'.*\.(jpg|png|jpeg|webp)', file.name)]
     files.sort(key=lambda x: x.name)
-    img2cbz(files, cbz)
+    img2cbz(files, cbz, profile, byte_budget)
     return cbz
 
 
-def img2cbz(files: List[Path], out: Path):
-    zip_file = zipfile.ZipFile(out, 'w')  # parameter "out" must be a .zip file
+def compress_type(name: str, data: bytes = None) -> int:
+    if Path(name).suffix.lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    if data:
+        sample = data[:1 << 16]
+        if len(zlib.compress(sample, 6)) > 0.9 * len(sample):
+            return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+# writes a cbz entry by entry, so pages can be appended as they become available
+class CbzWriter:
+
+    def __init__(self, out: Path):
+        self.out = out
+        self.zip_file = zipfile.ZipFile(out, 'w')
+
+    def add_bytes(self, name: str, data: bytes):
+        self.zip_file.writestr(name, data, compress_type=compress_type(name, data))
+
+    def add_file(self, name: str, file: Union[Path, BinaryIO]):
+        if isinstance(file, (str, Path)):
+            self.zip_file.write(file, name, compress_type=compress_type(name))
+            return
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = compress_type(name)
+        with self.zip_file.open(info, 'w') as entry:
+            shutil.copyfileobj(file, entry)
+
+    def close(self):
+        self.zip_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-    for image_file in files:
-        zip_file.write(image_file, compress_type=zipfile.ZIP_DEFLATED)
 
-    zip_file.close()
+def img2cbz(files: List[Path], out: Path, profile: OutputProfile = DEFAULT_PROFILE,
+            byte_budget: Optional[int] = CHAPTER_BYTE_BUDGET):
+    budget = ByteBudget(byte_budget, len(files))
+    with CbzWriter(out) as cbz:  # parameter "out" must be a .zip file
+        for image_file in files:
+            if profile.quality is None and byte_budget is None:
+                cbz.add_file(image_file.name, image_file)
+                continue
+            data = image_file.read_bytes()
+            reserved = budget.reserve()
+            encoded = profile_bytes(data, profile, reserved)
+            budget.settle(reserved, len(encoded or data))
+            if encoded is None:
+                cbz.add_bytes(image_file.name, data)
+            else:
+                cbz.add_bytes(f'{image_file.stem}.jpg', encoded)
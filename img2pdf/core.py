@@ -1,20 +1,76 @@
 import os
+import tempfile
+from contextlib import suppress
+from dataclasses import dataclass
 from io import BytesIO
-from typing import List, BinaryIO
+from typing import List, BinaryIO, Optional, Tuple
 from pathlib import Path
-from fpdf import FPDF
 import re
 
 from PIL import Image
+from loguru import logger
 
 
-def fld2pdf(folder: Path, out: str):
-    
+# output profiles: pages wider than max_width are scaled down and every page is re-encoded as a JPEG of the
+# given quality. the original profile keeps pages as they are unless the chapter is over its byte budget
+@dataclass(frozen=True)
+class OutputProfile:
+    name: str
+    max_width: Optional[int] = None
+    quality: Optional[int] = None
+
+
+PROFILES = {profile.name: profile for profile in (
+    OutputProfile('original'),
+    OutputProfile('balanced', max_width=1400, quality=85),
+    OutputProfile('small', max_width=1000, quality=70),
+)}
+DEFAULT_PROFILE = PROFILES.get(os.environ.get('OUTPUT_PROFILE', 'original'))
+if DEFAULT_PROFILE is None:
+    logger.warning(f'Unknown OUTPUT_PROFILE {os.environ["OUTPUT_PROFILE"]!r}, using original. '
+                   f'Valid profiles: {", ".join(PROFILES)}')
+    DEFAULT_PROFILE = PROFILES['original']
+CHAPTER_BYTE_BUDGET = int(os.environ.get('CHAPTER_BYTE_BUDGET_MB', 0)) * 1024 * 1024 or None
+BUDGET_QUALITY = 90
+MIN_QUALITY = 30
+MIN_SCALE = 0.25
+
+
+# splits a chapter byte budget between its pages. every page gets an equal share of what is left,
+# bytes a page does not use are carried over to the pages after it
+class ByteBudget:
+
+    def __init__(self, total: Optional[int], pages: int):
+        self.total = total
+        self.remaining = total
+        self.pages = pages
+
+    def reserve(self) -> Optional[int]:
+        if self.total is None:
+            return None
+        share = max(0, self.remaining) // max(1, self.pages)
+        self.remaining -= share
+        self.pages -= 1
+        return share
+
+    def settle(self, reserved: Optional[int], used: int):
+        if reserved is not None:
+            self.remaining += reserved - used
+
+
+def page_files(folder: Path) -> List[Path]:
     files = [file for file in folder.glob(r'*') if re.match(r'.*\.(jpg|png|jpeg|webp)', file.name)]
     files.sort(key=lambda x: x.name)
+    return files
+
+
+def fld2pdf(folder: Path, out: str, webtoon: bool = False, profile: OutputProfile = DEFAULT_PROFILE,
+            byte_budget: Optional[int] = CHAPTER_BYTE_BUDGET):
+    
+    files = page_files(folder)
     pdf = folder / f'{out}.pdf'
     thumb_path = make_thumb(folder, files)
-    img2pdf(files, pdf)
+    img2pdf(files, pdf, webtoon, profile, byte_budget)
     return pdf, thumb_path
 
 
@@ -32,15 +88,158 @@ def old_img2pdf(files: List[Path], out: Path):
         img.close()
 
 
-def pil_image(path: Path) -> (BytesIO, int, int):
-    img = new_img(path)
-    width, height = img.width, img.height
+# baseline RGB or grayscale JPEGs can be embedded in the pdf as they are (DCTDecode),
+# only their header is read to get the dimensions
+def is_passthrough_jpeg(img: Image.Image) -> bool:
+    return (img.format == 'JPEG' and img.mode in ('RGB', 'L')
+            and not img.info.get('progressive') and not img.info.get('progression'))
+
+
+def pdf_image(img: Image.Image, data: bytes) -> bytes:
+    if is_passthrough_jpeg(img):
+        return data
+    rgb = img.convert('RGB') if img.mode != 'RGB' else img
     try:
         membuf = BytesIO()
-        img.save(membuf, format='JPEG')
+        rgb.save(membuf, format='JPEG')
     finally:
-        img.close()
-    return membuf, width, height
+        if rgb is not img:
+            rgb.close()
+    return membuf.getvalue()
+
+
+# webtoon strips are cut into tiles about `TILE_RATIO` times as tall as they are wide. the cut is moved to the
+# closest row of a single color within `TILE_SEARCH` of that height, so panels are not sliced in half
+TILE_RATIO = 1.5
+TILE_SEARCH = 0.25
+TILE_TOLERANCE = 8
+
+
+def is_webtoon_strip(img: Image.Image) -> bool:
+    return img.height > img.width * TILE_RATIO * (1 + TILE_SEARCH)
+
+
+# only reads the header, so the page can be classified before it is decoded
+def is_webtoon_file(path: Path) -> bool:
+    with Image.open(path) as img:
+        return is_webtoon_strip(img)
+
+
+def is_uniform_row(pixels: bytes, width: int, y: int) -> bool:
+    row = pixels[y * width:(y + 1) * width]
+    return max(row) - min(row) <= TILE_TOLERANCE
+
+
+def tile_cuts(img: Image.Image) -> List[int]:
+    width, height = img.size
+    target = int(width * TILE_RATIO)
+    search = max(1, int(target * TILE_SEARCH))
+    cuts = [0]
+    while height - cuts[-1] > target + search:
+        start = cuts[-1] + target - search
+        with img.crop((0, start, width, start + 2 * search)) as band, band.convert('L') as gray:
+            pixels = gray.tobytes()
+        cut = cuts[-1] + target
+        # rows closest to the target height are tried first
+        for offset in range(search):
+            if is_uniform_row(pixels, width, search + offset):
+                cut = start + search + offset
+                break
+            if is_uniform_row(pixels, width, search - offset - 1):
+                cut = start + search - offset - 1
+                break
+        cuts.append(cut)
+    cuts.append(height)
+    return cuts
+
+
+# pdf pages for one image as (jpeg, width, height). in webtoon mode tall strips become several pages,
+# each tile is cropped from the decoded strip and encoded on its own so only one tile is converted at a time
+def pdf_pages(img: Image.Image, data: bytes, webtoon: bool = False) -> List[Tuple[bytes, int, int]]:
+    if not webtoon or not is_webtoon_strip(img):
+        return [(pdf_image(img, data), img.width, img.height)]
+    pages = []
+    cuts = tile_cuts(img)
+    for top, bottom in zip(cuts, cuts[1:]):
+        with img.crop((0, top, img.width, bottom)) as tile:
+            pages.append((pdf_image(tile, b''), tile.width, tile.height))
+    return pages
+
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    membuf = BytesIO()
+    img.save(membuf, format='JPEG', quality=quality)
+    return membuf.getvalue()
+
+
+# highest quality up to `quality` whose encoding fits in byte_budget, searched by bisection. when even MIN_QUALITY
+# does not fit, the page is scaled down first, by the square root of how far it is over, down to MIN_SCALE
+def fit_jpeg(img: Image.Image, quality: int, byte_budget: Optional[int] = None) -> bytes:
+    best = encode_jpeg(img, quality)
+    if byte_budget is None or len(best) <= byte_budget:
+        return best
+    best = encode_jpeg(img, MIN_QUALITY)
+    scale, resized = 1.0, img
+    try:
+        while len(best) > byte_budget and scale > MIN_SCALE:
+            scale = max(MIN_SCALE, scale * min(0.9, (byte_budget / len(best)) ** 0.5))
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            if resized is not img:
+                resized.close()
+            resized = img.resize(size, Image.LANCZOS)
+            best = encode_jpeg(resized, MIN_QUALITY)
+        if len(best) > byte_budget:
+            logger.warning(f'Page of {img.width}x{img.height} is {len(best)} bytes at its smallest, '
+                           f'over its budget of {byte_budget} bytes')
+            return best
+        low, high = MIN_QUALITY + 1, quality - 1
+        while low <= high:
+            middle = (low + high) // 2
+            encoded = encode_jpeg(resized, middle)
+            if len(encoded) <= byte_budget:
+                best, low = encoded, middle + 1
+            else:
+                high = middle - 1
+        return best
+    finally:
+        if resized is not img:
+            resized.close()
+
+
+# returns the page re-encoded for the profile, or None when the original bytes should be kept
+def profile_image(img: Image.Image, data: bytes, profile: OutputProfile = DEFAULT_PROFILE,
+                  byte_budget: Optional[int] = None) -> Optional[bytes]:
+    if profile.quality is None and (byte_budget is None or len(data) <= byte_budget):
+        return None
+    mode = 'L' if img.mode == 'L' else 'RGB'
+    if profile.max_width and img.width > profile.max_width:
+        size = (profile.max_width, max(1, round(img.height * profile.max_width / img.width)))
+        img.draft(mode, size)
+        with img.convert(mode) as converted:
+            with converted.resize(size, Image.LANCZOS) as resized:
+                return fit_jpeg(resized, profile.quality or BUDGET_QUALITY, byte_budget)
+    passthrough = is_passthrough_jpeg(img)
+    converted = img.convert(mode) if img.mode != mode else img
+    try:
+        encoded = fit_jpeg(converted, profile.quality or BUDGET_QUALITY, byte_budget)
+    finally:
+        if converted is not img:
+            converted.close()
+    if passthrough and len(data) <= len(encoded):
+        return None
+    return encoded
+
+
+def profile_bytes(data: bytes, profile: OutputProfile = DEFAULT_PROFILE,
+                  byte_budget: Optional[int] = None) -> Optional[bytes]:
+    with Image.open(BytesIO(data)) as img:
+        return profile_image(img, data, profile, byte_budget)
+
+
+def pil_image(path: Path) -> (BytesIO, int, int):
+    data = path.read_bytes()
+    with Image.open(BytesIO(data)) as img:
+        return BytesIO(pdf_image(img, data)), img.width, img.height
 
 
 def unicode_to_latin1(s):
@@ -55,42 +254,164 @@ def unicode_to_latin1(s):
     return s
 
 
-def img2pdf(files: List[Path], out: Path):
-    pdf = FPDF('P', 'pt')
-    for imageFile in files:
-        img_bytes, width, height = pil_image(imageFile)
-        
-        pdf.add_page(format=(width, height))
+def jpeg_components(jpeg: bytes) -> int:
+    # number of color components in the first frame header (SOFn) of the JPEG
+    i = 2
+    while i + 9 < len(jpeg):
+        if jpeg[i] != 0xFF:
+            i += 1
+            continue
+        marker = jpeg[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            i += 1 if marker == 0xFF else 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return jpeg[i + 9]
+        i += 2 + int.from_bytes(jpeg[i + 2:i + 4], 'big')
+    return 3
+
+
+COLOR_SPACES = {1: b'/DeviceGray', 3: b'/DeviceRGB', 4: b'/DeviceCMYK'}
+
+
+def pdf_string(s: str) -> bytes:
+    s = unicode_to_latin1(s).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return b'(' + s.encode('latin1') + b')'
+
 
-        pdf.image(img_bytes, 0, 0, width, height)
+# writes the pdf as pages are added: every page is an image XObject (the JPEG as it is, DCTDecode), a content
+# stream drawing it over the whole page and the page object, sized to the image in points. only the offsets of
+# the objects are kept for the xref table, the catalog, page tree and info objects are written on close
+class PdfWriter:
+    CATALOG, PAGES, INFO = 1, 2, 3
 
-        img_bytes.close()
+    def __init__(self, out: Path, title: str = None):
+        self.out = out
+        self.title = out.stem if title is None else title
+        self.file = open(out, 'wb')
+        self.offsets = {}
+        self.position = 0
+        self.pages = 0
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
 
-    pdf.set_title(unicode_to_latin1(out.stem))
-    pdf.output(out, "F")
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self.position += len(data)
+
+    def _object(self, number: int, body: bytes, stream: bytes = None):
+        self.offsets[number] = self.position
+        self._write(b'%d 0 obj\n' % number + body)
+        if stream is not None:
+            self._write(b'\nstream\n')
+            self._write(stream)
+            self._write(b'\nendstream')
+        self._write(b'\nendobj\n')
+
+    @classmethod
+    def page_object(cls, index: int) -> int:
+        return cls.INFO + 3 * index + 3
+
+    def add_page(self, jpeg: bytes, width: int, height: int):
+        page = self.page_object(self.pages)
+        image, contents = page - 2, page - 1
+        color_space = COLOR_SPACES.get(jpeg_components(jpeg), b'/DeviceRGB')
+        self._object(image, b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s '
+                            b'/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>'
+                     % (width, height, color_space, len(jpeg)), jpeg)
+        draw = b'q %d 0 0 %d 0 0 cm /I0 Do Q' % (width, height)
+        self._object(contents, b'<< /Length %d >>' % len(draw), draw)
+        self._object(page, b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+                           b'/Resources << /XObject << /I0 %d 0 R >> >> /Contents %d 0 R >>'
+                     % (self.PAGES, width, height, image, contents))
+        self.pages += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        kids = b' '.join(b'%d 0 R' % self.page_object(i) for i in range(self.pages))
+        self._object(self.PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, self.pages))
+        self._object(self.CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES)
+        self._object(self.INFO, b'<< /Title %s >>' % pdf_string(self.title))
+        size = self.page_object(self.pages) - 2
+        xref = self.position
+        self._write(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+        for number in range(1, size):
+            self._write(b'%010d 00000 n \n' % self.offsets[number])
+        self._write(b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                    % (size, self.CATALOG, self.INFO, xref))
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def img2pdf(files: List[Path], out: Path, webtoon: bool = False, profile: OutputProfile = DEFAULT_PROFILE,
+            byte_budget: Optional[int] = CHAPTER_BYTE_BUDGET):
+    budget = ByteBudget(byte_budget, len(files))
+    with PdfWriter(out) as pdf:
+        for imageFile in files:
+            data = imageFile.read_bytes()
+            reserved = budget.reserve()
+            data = profile_bytes(data, profile, reserved) or data
+            budget.settle(reserved, len(data))
+            with Image.open(BytesIO(data)) as img:
+                for jpeg, width, height in pdf_pages(img, data, webtoon):
+                    pdf.add_page(jpeg, width, height)
 
 
 def fld2thumb(folder: Path):
-    files = [file for file in folder.glob(r'*') if re.match(r'.*\.(jpg|png|jpeg|webp)', file.name)]
-    files.sort(key=lambda x: x.name)
+    files = page_files(folder)
     thumb_path = make_thumb(folder, files)
     return thumb_path
 
 
-def make_thumb(folder, files):
+def make_thumb(folder, files, thumb_path: Path = None):
+    thumb_path = thumb_path or folder / 'thumbnail' / f'thumbnail.jpg'
+    if thumb_path.exists():
+        return thumb_path
+
     aspect_ratio = 0.7
     if len(files) > 1:
+        # only the header is read, the second page is never decoded
         with Image.open(files[1]) as img:
             aspect_ratio = img.width / img.height
 
-    thumbnail = Image.open(files[0]).convert('RGB')
+    with Image.open(files[0]) as img:
+        return save_thumb(img, aspect_ratio, thumb_path)
+
+
+def save_thumb(img: Image.Image, aspect_ratio, thumb_path: Path):
     tg_max_size = (300, 300)
-    thumbnail = crop_thumb(thumbnail, aspect_ratio)
+    # JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale that is still larger than the thumbnail,
+    # then cropped before the conversion so a webtoon strip is only converted as far as the thumbnail reaches
+    img.draft('RGB', tg_max_size)
+    cropped = crop_thumb(img, aspect_ratio)
+    thumbnail = cropped.convert('RGB')
+    if cropped is not img:
+        cropped.close()
     thumbnail.thumbnail(tg_max_size)
-    thumb_path = folder / 'thumbnail' / f'thumbnail.jpg'
     os.makedirs(thumb_path.parent, exist_ok=True)
-    thumbnail.save(thumb_path)
-    thumbnail.close()
+    # thumbnails can be shared between chapters, they are written to a temporary file and moved into place
+    fd, tmp_path = tempfile.mkstemp(dir=thumb_path.parent, prefix='.thumbnail-', suffix='.jpg')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            thumbnail.save(tmp, format='JPEG')
+        os.replace(tmp_path, thumb_path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    finally:
+        thumbnail.close()
     return thumb_path
 
 
@@ -1,5 +1,6 @@
 import asyncio as aio
 import os
+import shutil
 import uvloop
 
 uvloop.install()
@@ -9,6 +10,7 @@ from bot import bot, manga_updater
 from models import DB 
 from extras import load_plugin
 from api import run_web_server
+from tools.workers import conversion_pool
 
 load_plugin(Path("extras.py"))
 
@@ -17,8 +19,14 @@ async def async_main():
     await db.connect()
     
 if __name__ == '__main__':
+    # only here, not in bot.py: conversion workers import the main module and its imports again
+    if os.path.exists('cache'):
+        shutil.rmtree('cache')
     loop = aio.get_event_loop_policy().get_event_loop()
     loop.run_until_complete(async_main())
     loop.create_task(manga_updater())
-    bot.run()
+    try:
+        bot.run()
+    finally:
+        conversion_pool.shutdown()
 
@@ -53,8 +53,9 @@ class DB(metaclass=LanguageSingleton):
         async with self.engine.begin() as conn:
             await conn.run_sync(SQLModel.metadata.create_all, checkfirst=True)
 
+    # the object stays readable after the session closes, callers keep using what they stored
     async def add(self, other: SQLModel):
-        async with AsyncSession(self.engine) as session:  # type: AsyncSession
+        async with AsyncSession(self.engine, expire_on_commit=False) as session:  # type: AsyncSession
             async with session.begin():
                 session.add(other)
 
@@ -1,3 +1,4 @@
+from functools import partial
 from typing import List, AsyncIterable
 from urllib.parse import urlparse, urljoin, quote, quote_plus
 
@@ -13,6 +14,8 @@ class AsuraScansClient(MangaClient):
     search_param = 's'
     updates_url = base_url.geturl()
 
+    webtoon = True
+
     pre_headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:97.0) Gecko/20100101 Firefox/97.0'
     }
@@ -105,9 +108,9 @@ class AsuraScansClient(MangaClient):
 
         request_url = f'{manga_card.url}'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga_card))
 
-        for chapter in self.chapters_from_page(content, manga_card):
+        for chapter in chapters:
             yield chapter
 
     async def contains_url(self, url: str):
@@ -115,9 +118,7 @@ class AsuraScansClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.updates_url)
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.updates_url, self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and updates.get(lc.url) != lc.chapter_url]
         not_updated = [lc.url for lc in last_chapters if
@@ -1,13 +1,24 @@
-import os, asyncio
+import os, asyncio, copy, hashlib, tempfile
 from abc import abstractmethod, ABC
+from collections import deque
+from contextlib import suppress
 from dataclasses import dataclass
-from typing import List, AsyncIterable
+from typing import List, AsyncIterable, Callable, TypeVar
 
 from aiohttp import ClientSession
 from pathlib import Path
 
 from models import LastChapter
 from tools import LanguageSingleton
+from tools.connector import shared_connector
+from tools.http_cache import revalidation_cache
+from tools.page_cache import page_cache
+from tools.retry import RetryPolicy
+from tools.scheduler import download_scheduler, Priority
+from tools.singleflight import SingleFlight
+from tools.ttl_cache import TTLCache
+
+T = TypeVar("T")
 
 
 @dataclass
@@ -39,6 +50,22 @@ class MangaChapter:
         return str(hash(self.url))
 
 
+# streams the body of response into path chunk by chunk, writing from a worker thread.
+# the file only appears at path once it is complete
+async def save_response(response, path: Path, chunk_size: int = 1 << 16):
+    os.makedirs(path.parent, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.download-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                await asyncio.to_thread(f.write, chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
 def clean(name, length=-1):
     while '  ' in name:
         name = name.replace('  ', ' ')
@@ -50,46 +77,94 @@ def clean(name, length=-1):
 
 class MangaClient(ClientSession, metaclass=LanguageSingleton):
 
+    scheduler = download_scheduler
+    page_cache = page_cache
+    retry_policy = RetryPolicy()
+    revalidation_cache = revalidation_cache
+    in_flight = SingleFlight()
+    search_cache = TTLCache()
+    search_ttl = 600
+    search_stale = 3600
+    picture_window = 16
+    # overrides DOWNLOAD_LIMIT_PER_HOST for the hosts this client downloads pictures from
+    download_limit_per_host = None
+    # long strip chapters, their pages are split into tiles in the pdf
+    webtoon = False
+
     def __init__(self, *args, name="client", **kwargs):
         if name == "client":
             raise NotImplementedError
+        kwargs.setdefault('connector', shared_connector())
+        kwargs.setdefault('connector_owner', False)
         super().__init__(*args, **kwargs)
         self.name = name
 
+    async def fetch(self, url, *args, method='get', data=None, **kwargs):
+        if method == 'get':
+            return await self.get(url, *args, **kwargs)
+        elif method == 'post':
+            return await self.post(url, data=data or {}, **kwargs)
+        else:
+            raise ValueError
+
+    async def _read(self, url, *args, **kwargs):
+        response = await self.fetch(url, *args, **kwargs)
+        return await response.read()
+
+    async def _download(self, key, url, *args, **kwargs):
+        response = await self.fetch(url, *args, **kwargs)
+        if str(response.status).startswith('2'):
+            await save_response(response, self.page_cache.path(key))
+            self.page_cache.add(key)
+        else:
+            response.release()
+        return response
+
     async def get_url(self, url, *args, file_name=None, cache=False, req_content=True, method='get', data=None,
                       **kwargs):
         def response(): pass
         response.status = "200"
         if cache:
             path = Path(f'cache/{self.name}/{file_name}')
-            os.makedirs(path.parent, exist_ok=True)
-            try:
-                with open(path, 'rb') as f:
-                    content = f.read()
-            except FileNotFoundError:
-                if method == 'get':
-                    response = await self.get(url, *args, **kwargs)
-                elif method == 'post':
-                    response = await self.post(url, data=data or {}, **kwargs)
-                else:
-                    raise ValueError
-                if str(response.status).startswith('2'):
-                    content = await response.read()
-                    with open(path, 'wb') as f:
-                        f.write(content)
+            content = None
+            if not path.exists():
+                key = self.page_cache.key(url, method, data)
+                if not self.page_cache.get(key):
+                    response = await self.in_flight.do(
+                        ('cache', key), lambda: self._download(key, url, *args, method=method, data=data, **kwargs)
+                    )
+                if key in self.page_cache:
+                    self.page_cache.link(key, path)
+            if req_content and path.exists():
+                content = await asyncio.to_thread(path.read_bytes)
+        elif req_content:
+            key = ('content', self.name, self.page_cache.key(url, method, data))
+            content = await self.in_flight.do(key, lambda: self._read(url, *args, method=method, data=data, **kwargs))
         else:
-            if method == 'get':
-                response = await self.get(url, *args, **kwargs)
-            elif method == 'post':
-                response = await self.post(url, data=data or {}, **kwargs)
-            else:
-                raise ValueError
+            response = await self.fetch(url, *args, method=method, data=data, **kwargs)
             content = await response.read()
         if req_content:
             return content
         else:
             return response
 
+    # fetches url conditionally and returns parser(content), reusing the previous result when the page is unchanged.
+    # only 200 answers are stored, and callers get a copy of the stored result (sharing this client) so changes they
+    # make to it, like the pictures of a chapter, do not outlive the request
+    async def get_parsed(self, url, parser: Callable[[bytes], T], *args, headers=None, **kwargs) -> T:
+        key = (self.name, url, getattr(parser, '__qualname__', None) or parser.func.__qualname__)
+        entry = self.revalidation_cache.get(key)
+        headers = {**(headers or {}), **(entry.headers() if entry else {})}
+        response = await self.get_url(url, *args, req_content=False, headers=headers or None, **kwargs)
+        if response.status == 304 and entry:
+            self.revalidation_cache.revalidated += 1
+            return copy.deepcopy(entry.value, {id(self): self})
+        value = parser(await response.read())
+        self.revalidation_cache.refetched += 1
+        if response.status == 200:
+            self.revalidation_cache.put(key, response, copy.deepcopy(value, {id(self): self}))
+        return value
+
     async def set_pictures(self, manga_chapter: MangaChapter):
         requests_url = manga_chapter.url
 
@@ -101,37 +176,66 @@ class MangaClient(ClientSession, metaclass=LanguageSingleton):
 
         return manga_chapter
     
-    async def download_picture(self, picture: str, file_name: str, manga_chapter: MangaChapter):
-      for _ in range(5):
-        req = await self.get_picture(manga_chapter, picture, file_name=file_name, cache=True, req_content=False)
-        if str(req.status).startswith('2'):
-          break
-      else:
-        raise ValueError 
-
-    async def download_pictures(self, manga_chapter: MangaChapter):
+    async def download_picture(self, picture: str, file_name: str, manga_chapter: MangaChapter,
+                               priority: int = Priority.INTERACTIVE):
+        async def attempt():
+            async with self.scheduler.slot(picture, priority, self.download_limit_per_host):
+                return await self.get_picture(manga_chapter, picture, file_name=file_name, cache=True,
+                                              req_content=False)
+
+        await self.retry_policy.run(self.name, attempt)
+
+    # builds of different variants of a chapter (build_key) can run at the same time, each gets its own folder
+    @staticmethod
+    def pictures_folder_name(manga_chapter: MangaChapter, build_key: str = None) -> str:
+        name = f'{clean(manga_chapter.manga.name)}/{clean(manga_chapter.name)}'
+        if build_key:
+            name += f' {hashlib.sha1(build_key.encode()).hexdigest()[:8]}'
+        return name
+
+    def pictures_folder(self, manga_chapter: MangaChapter, build_key: str = None) -> Path:
+        return Path(f'cache/{manga_chapter.client.name}') / self.pictures_folder_name(manga_chapter, build_key)
+
+    # chapters of the same manga share one thumbnail
+    def thumbnail_path(self, manga_card: MangaCard) -> Path:
+        return Path(f'cache/{self.name}/thumbnails/{hashlib.sha1(manga_card.url.encode()).hexdigest()}.jpg')
+
+    # yields the downloaded pages in page order. at most `window` pages are downloading or waiting for an
+    # earlier page at a time, so pages can be consumed while the rest of the chapter is still downloading
+    async def iter_pictures(self, manga_chapter: MangaChapter, priority: int = Priority.INTERACTIVE,
+                            window: int = None, build_key: str = None) -> AsyncIterable[Path]:
         if not manga_chapter.pictures:
             await self.set_pictures(manga_chapter)
 
-        folder_name = f'{clean(manga_chapter.manga.name)}/{clean(manga_chapter.name)}'
-        i = 0
-        tasks = []
-        for picture in manga_chapter.pictures:
+        window = window or self.picture_window
+        folder_name = self.pictures_folder_name(manga_chapter, build_key)
+        file_names = []
+        for i, picture in enumerate(manga_chapter.pictures):
             ext = picture.split('.')[-1].split('?')[0]
-            file_name = f'{folder_name}/{format(i, "05d")}.{ext}'
-            task = asyncio.create_task(
-                self.download_picture(picture, file_name, manga_chapter)
-            )
-            tasks.append(task)
-            i += 1
-            
+            file_names.append((picture, f'{folder_name}/{format(i, "05d")}.{ext}'))
+
+        pending = iter(file_names)
+        tasks = deque()
+
+        def start_next():
+            for picture, file_name in pending:
+                task = asyncio.create_task(self.download_picture(picture, file_name, manga_chapter, priority))
+                tasks.append((task, file_name))
+                return
+
+        for _ in range(window):
+            start_next()
         try:
-            await asyncio.gather(*tasks)
-        except BaseException:
-            for task in tasks:
+            while tasks:
+                task, file_name = tasks[0]
                 await task
-       
-        return Path(f'cache/{manga_chapter.client.name}') / folder_name
+                tasks.popleft()
+                start_next()
+                yield Path(f'cache/{manga_chapter.client.name}') / file_name
+        finally:
+            for task, _ in tasks:
+                task.cancel()
+            await asyncio.gather(*(task for task, _ in tasks), return_exceptions=True)
 
     async def get_picture(self, manga_chapter: MangaChapter, url, *args, **kwargs):
         return await self.get_url(url, *args, **kwargs)
@@ -142,6 +246,10 @@ class MangaClient(ClientSession, metaclass=LanguageSingleton):
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
         return [lc.url for lc in last_chapters], []
 
+    async def cached_search(self, query: str = "", page: int = 1) -> List[MangaCard]:
+        return await self.search_cache.get_or_fetch((self, query, page), lambda: self.search(query, page),
+                                                    ttl=self.search_ttl, stale=self.search_stale)
+
     @abstractmethod
     async def search(self, query: str = "", page: int = 1) -> List[MangaCard]:
         raise NotImplementedError
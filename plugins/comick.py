@@ -1,3 +1,4 @@
+from functools import partial
 import json
 from dataclasses import dataclass
 from typing import List, AsyncIterable
@@ -29,6 +30,8 @@ class ComickClient(MangaClient):
     updates_url = "https://api.comick.app/chapter/?page=1&order=new&tachiyomi=true&accept_erotic_content=true"
     covers_url = urlparse("https://meo.comick.pictures/")
 
+    webtoon = True
+
     pre_headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:97.0) Gecko/20100101 Firefox/97.0'
     }
@@ -110,9 +113,9 @@ class ComickClient(MangaClient):
 
         request_url = f'{manga_card.url}&limit=100000'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga_card))
 
-        for chapter in self.chapters_from_page(content, manga_card):
+        for chapter in chapters:
             yield chapter
 
     async def contains_url(self, url: str):
@@ -125,9 +125,7 @@ class KissMangaClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.base_url.geturl())
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.base_url.geturl(), self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and updates.get(lc.url) != lc.chapter_url]
         not_updated = [lc.url for lc in last_chapters if
@@ -1,3 +1,4 @@
+from functools import partial
 import re
 from dataclasses import dataclass
 from typing import List, AsyncIterable
@@ -116,9 +117,9 @@ class MangaBuddyClient(MangaClient):
 
         request_url = f'{manga_card.url}'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga_card))
 
-        for chapter in self.chapters_from_page(content, manga_card):
+        for chapter in chapters:
             yield chapter
 
     async def contains_url(self, url: str):
@@ -126,9 +127,7 @@ class MangaBuddyClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.home_page)
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.home_page, self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and updates.get(lc.url) != lc.chapter_url]
         not_updated = [lc.url for lc in last_chapters if not updates.get(lc.url)
@@ -1,3 +1,4 @@
+from functools import partial
 import json
 from typing import List, AsyncIterable
 from urllib.parse import urlparse, urljoin, quote
@@ -123,9 +124,9 @@ class ManganatoClient(MangaClient):
 
         request_url = f'{manga_card.url}'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga_card))
 
-        for chapter in self.chapters_from_page(content, manga_card):
+        for chapter in chapters:
             yield chapter
 
     async def contains_url(self, url: str):
@@ -133,9 +134,7 @@ class ManganatoClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.base_url.geturl())
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.base_url.geturl(), self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and updates.get(lc.url) != lc.chapter_url]
         not_updated = [lc.url for lc in last_chapters if not updates.get(lc.url)
@@ -1,3 +1,4 @@
+from functools import partial
 from typing import List, AsyncIterable
 from urllib.parse import urlparse, urljoin, quote
 
@@ -101,9 +102,9 @@ class ManganeloClient(MangaClient):
 
         request_url = f'{manga_card.url}'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga_card))
 
-        for chapter in self.chapters_from_page(content, manga_card):
+        for chapter in chapters:
             yield chapter
 
     def get_picture(self, manga_chapter: MangaChapter, url, *args, **kwargs):
@@ -117,9 +118,7 @@ class ManganeloClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.updates_url)
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.updates_url, self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and updates.get(lc.url) != lc.chapter_url]
         not_updated = [lc.url for lc in last_chapters if
@@ -1,10 +1,12 @@
+from functools import partial
+import asyncio
 import json
 import re
 from typing import List, AsyncIterable
 from urllib.parse import urlparse, urljoin, quote_plus
 
 from plugins.client import MangaClient, MangaCard, MangaChapter, LastChapter
-from .search_engine import search
+from .search_engine import SearchIndex
 
 
 class MangaSeeClient(MangaClient):
@@ -18,8 +20,42 @@ class MangaSeeClient(MangaClient):
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:97.0) Gecko/20100101 Firefox/97.0'
     }
 
+    catalog_refresh = 6 * 60 * 60
+
     def __init__(self, *args, name="Mangasee", **kwargs):
         super().__init__(*args, name=name, headers=self.pre_headers, **kwargs)
+        self.catalog = SearchIndex([], self.title_from_document, self.text_from_document)
+        self.catalog_task = None
+
+    @staticmethod
+    def title_from_document(doc) -> str:
+        return doc['i']
+
+    @staticmethod
+    def text_from_document(doc) -> str:
+        return doc['s'] + ' ' + ' '.join(doc['a'])
+
+    def catalog_from_page(self, page: bytes):
+        return SearchIndex(json.loads(page), self.title_from_document, self.text_from_document)
+
+    async def refresh_catalog(self):
+        content = await self.get_url(self.search_url, method="post")
+        self.catalog = await asyncio.to_thread(self.catalog_from_page, content)
+
+    async def refresh_catalog_forever(self):
+        while True:
+            await asyncio.sleep(self.catalog_refresh)
+            try:
+                await self.refresh_catalog()
+            except Exception as e:
+                print(f'Error refreshing {self.name} catalog: {e}')
+
+    async def get_catalog(self):
+        if not self.catalog:
+            await self.in_flight.do(('catalog', self.name), self.refresh_catalog)
+        if self.catalog_task is None:
+            self.catalog_task = asyncio.create_task(self.refresh_catalog_forever())
+        return self.catalog
 
     def mangas_from_page(self, documents: List):
         names = [doc['s'] for doc in documents]
@@ -134,19 +170,9 @@ class MangaSeeClient(MangaClient):
         return images_url
 
     async def search(self, query: str = "", page: int = 1) -> List[MangaCard]:
-        def text_from_document(doc) -> str:
-            return doc['s'] + ' ' + ' '.join(doc['a'])
-
-        def title_from_document(doc) -> str:
-            return doc['i']
-
-        request_url = self.search_url
-
-        content = await self.get_url(request_url, method="post")
+        catalog = await self.get_catalog()
 
-        documents = json.loads(content)
-
-        results = search(query, documents, title_from_document, text_from_document)[(page - 1) * 20:page * 20]
+        results = catalog.search(query, limit=page * 20)[(page - 1) * 20:]
 
         return self.mangas_from_page(results)
 
@@ -164,9 +190,9 @@ class MangaSeeClient(MangaClient):
 
         request_url = f'{manga_card.url}'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga_card))
 
-        for ch in self.chapters_from_page(content, manga_card):
+        for ch in chapters:
             yield ch
 
     async def contains_url(self, url: str):
@@ -174,9 +200,7 @@ class MangaSeeClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.base_url.geturl())
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.base_url.geturl(), self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and updates.get(lc.url) != lc.chapter_url]
         not_updated = [lc.url for lc in last_chapters if
@@ -1,3 +1,4 @@
+from functools import partial
 import re
 from typing import List, AsyncIterable
 import json
@@ -125,9 +126,9 @@ class MangasInClient(MangaClient):
 
         request_url = f'{manga.url}'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga))
 
-        for chapter in self.chapters_from_page(content, manga):
+        for chapter in chapters:
             yield chapter
 
     async def contains_url(self, url: str):
@@ -135,9 +136,7 @@ class MangasInClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.base_url.geturl())
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.base_url.geturl(), self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and updates.get(lc.url) != lc.chapter_url]
         not_updated = [lc.url for lc in last_chapters if not updates.get(lc.url) or updates.get(lc.url) == lc.chapter_url]
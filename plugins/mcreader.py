@@ -1,3 +1,4 @@
+from functools import partial
 from typing import List, AsyncIterable
 from urllib.parse import urlparse, urljoin, quote, quote_plus
 import json
@@ -114,9 +115,9 @@ class McReaderClient(MangaClient):
 
         request_url = f'{manga_card.url}/{self.chapters}'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga_card))
 
-        for chapter in self.chapters_from_page(content, manga_card):
+        for chapter in chapters:
             yield chapter
 
     async def contains_url(self, url: str):
@@ -127,9 +128,7 @@ class McReaderClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.latest_uploads)
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.latest_uploads, self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and updates.get(lc.url) != self.number_from_url(lc.chapter_url)]
         not_updated = [lc.url for lc in last_chapters if not updates.get(lc.url) or updates.get(lc.url) == self.number_from_url(lc.chapter_url)]
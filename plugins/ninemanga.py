@@ -1,3 +1,4 @@
+from functools import partial
 from typing import List, AsyncIterable, Optional
 from urllib.parse import urlparse, urljoin, quote, quote_plus
 
@@ -124,9 +125,9 @@ class NineMangaClient(MangaClient):
 
         request_url = f'{manga_card.url}?{self.query_param}'
 
-        content = await self.get_url(request_url)
+        chapters = await self.get_parsed(request_url, partial(self.chapters_from_page, manga=manga_card))
 
-        for chapter in self.chapters_from_page(content, manga_card):
+        for chapter in chapters:
             yield chapter
 
     async def contains_url(self, url: str):
@@ -142,9 +143,7 @@ class NineMangaClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.updates_url)
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.updates_url, self.updates_from_page)
 
         updated = [lc.url for lc in last_chapters if updates.get(lc.url) and
                    self.get_chapter_number_from_url(updates.get(lc.url)) != self.get_chapter_number_from_url(lc.chapter_url)]
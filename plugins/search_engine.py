@@ -1,90 +1,86 @@
-from typing import TypeVar, Callable, List
+import heapq
+from collections import defaultdict
+from typing import TypeVar, Callable, List, Dict, Iterable, Optional, Generic
 
 T = TypeVar("T")
 
 
-class KMP:
-
-    def __init__(self, pattern: str) -> None:
-        self.pattern = pattern
-        self.pi = self.computeLPSArray()
-
-    def computeLPSArray(self):
-        length = 0  # length of the previous longest prefix suffix
-        M = len(self.pattern)
-        lps = [0] * M
-        i = 1
-
-        # the loop calculates lps[i] for i = 1 to M-1 
-        while i < M:
-            if self.pattern[i] == self.pattern[length]:
-                length += 1
-                lps[i] = length
-                i += 1
-            else:
-                # This is tricky. Consider the example. 
-                # AAACAAAA and i = 7. The idea is similar
-                # to search step. 
-
-                if length != 0:
-                    length = lps[length - 1]
-                    # Also, note that we do not increment i here 
-                else:
-                    lps[i] = 0
-                    i += 1
-
-        return lps
-
-    # Python program for KMP Algorithm 
-
-    def KMPSearch(self, txt):
-        pat = self.pattern
-        M = len(pat)
-        N = len(txt)
-
-        lps = self.pi
-
-        i = 0  # index for txt[]
-        j = 0  # index for pat[]
-
-        while i < N:
-
-            if pat[j] == txt[i]:
-                i += 1
-                j += 1
-
-            if j == M:
-                return True
-
-            # mismatch after j matches 
-            elif i < N and pat[j] != txt[i]:
-                # Do not match lps[0..lps[j-1]] characters, 
-                # they will match anyway 
-                if j != 0:
-                    j = lps[j - 1]
-                else:
-                    i += 1
-        return False
-
-
-def search(query: str, documents: List[T], get_title: Callable[[T], str], get_text: Callable[[T], str]):
+def score(query: str, qwords: List[str], title: str, text: str) -> int:
+    total = 0
+    for word in qwords:
+        if word in text:
+            total += 1
+        if word in title:
+            total += 5
+        if title == query:
+            total += 1000
+    return total
+
+
+def rank(scored: Iterable, limit: Optional[int] = None):
+    # ties are broken by document position, later documents first
+    if limit is None:
+        return sorted(scored, reverse=True)
+    return heapq.nlargest(limit, scored)
+
+
+def trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# documents are indexed once: their lowercased title and text are kept together with a trigram
+# inverted index over both, so a query only scores the documents that can contain its words
+class SearchIndex(Generic[T]):
+
+    def __init__(self, documents: List[T], get_title: Callable[[T], str], get_text: Callable[[T], str]):
+        self.documents = list(documents)
+        self.titles = [get_title(doc).lower() for doc in self.documents]
+        self.texts = [get_text(doc).lower() for doc in self.documents]
+        self.fields = [f'{title}\0{text}' for title, text in zip(self.titles, self.texts)]
+        self.exact_titles: Dict[str, List[int]] = defaultdict(list)
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        for i, (title, field) in enumerate(zip(self.titles, self.fields)):
+            self.exact_titles[title].append(i)
+            for trigram in trigrams(field):
+                self.postings[trigram].append(i)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def word_candidates(self, word: str):
+        if len(word) < 3:
+            return {i for i, field in enumerate(self.fields) if word in field}
+        postings = sorted((self.postings.get(trigram, []) for trigram in trigrams(word)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return candidates
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[T]:
+        query = query.lower()
+        qwords = query.split()
+        if not qwords:
+            return []
+        candidates = set(self.exact_titles.get(query, []))
+        for word in set(qwords):
+            candidates |= self.word_candidates(word)
+        scored = []
+        for i in candidates:
+            doc_score = score(query, qwords, self.titles[i], self.texts[i])
+            if doc_score > 0:
+                scored.append((doc_score, i))
+        return [self.documents[i] for _, i in rank(scored, limit)]
+
+
+def search(query: str, documents: List[T], get_title: Callable[[T], str], get_text: Callable[[T], str],
+           limit: Optional[int] = None):
     query = query.lower()
     qwords = query.split()
-    qkmp = [KMP(word) for word in qwords]
-    ranking = []
-    for doc in documents:
-        score = 0
-        title = get_title(doc).lower()
-        text = get_text(doc).lower()
-        for kmp in qkmp:
-            if kmp.KMPSearch(text):
-                score += 1
-            if kmp.KMPSearch(title):
-                score += 5
-            if title == query:
-                score += 1000
-        if score > 0:
-            ranking.append((score, len(ranking), doc))
-    ranking.sort()
-    ranking.reverse()
-    return [doc for (_, _, doc) in ranking]
+    scored = []
+    for i, doc in enumerate(documents):
+        doc_score = score(query, qwords, get_title(doc).lower(), get_text(doc).lower())
+        if doc_score > 0:
+            scored.append((doc_score, i))
+    return [documents[i] for _, i in rank(scored, limit)]
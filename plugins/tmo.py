@@ -124,9 +124,7 @@ class TMOClient(MangaClient):
 
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
 
-        content = await self.get_url(self.latest_uploads)
-
-        updates = self.updates_from_page(content)
+        updates = await self.get_parsed(self.latest_uploads, self.updates_from_page)
 
         s = set(updates)
 
@@ -0,0 +1,45 @@
+import os
+import ssl
+from collections import Counter
+from typing import Optional
+
+from aiohttp import TCPConnector
+
+ssl_context = ssl.create_default_context()
+
+_connector: Optional[TCPConnector] = None
+
+
+# one connection pool shared by every MangaClient, so sessions that hit the same hosts reuse
+# their keep-alive connections, DNS answers and TLS context instead of each keeping their own
+def shared_connector() -> TCPConnector:
+    global _connector
+    if _connector is None or _connector.closed:
+        _connector = TCPConnector(
+            limit=int(os.environ.get('HTTP_LIMIT', 100)),
+            limit_per_host=int(os.environ.get('HTTP_LIMIT_PER_HOST', 10)),
+            ttl_dns_cache=int(os.environ.get('HTTP_DNS_TTL', 300)),
+            keepalive_timeout=float(os.environ.get('HTTP_KEEPALIVE', 30)),
+            enable_cleanup_closed=True,
+            ssl=ssl_context,
+        )
+    return _connector
+
+
+def stats():
+    if _connector is None:
+        return {}
+    acquired_per_host = Counter()
+    for key, protocols in getattr(_connector, '_acquired_per_host', {}).items():
+        acquired_per_host[key.host] += len(protocols)
+    idle_per_host = Counter()
+    for key, connections in getattr(_connector, '_conns', {}).items():
+        idle_per_host[key.host] += len(connections)
+    return {
+        "limit": _connector.limit,
+        "limit_per_host": _connector.limit_per_host,
+        "in_use": len(getattr(_connector, '_acquired', ())),
+        "idle": sum(idle_per_host.values()),
+        "in_use_per_host": dict(acquired_per_host),
+        "idle_per_host": dict(idle_per_host),
+    }
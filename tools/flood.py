@@ -1,22 +1,143 @@
 import asyncio
-from typing import Callable, Awaitable, Any
+import os
+import time
+from typing import Callable, Awaitable, Any, Dict, Hashable, List, Optional
 
 import pyrogram.errors
 
 
-# retries an async awaitable as long as it raises FloodWait, and waits for err.x time
+# refills `rate` tokens per second up to `capacity`. a penalty holds the refill back until the wait is over and
+# leaves a single token for the retry
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, cost: float = 1) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        return max(0.0, self.updated - now) + max(0.0, (cost - self.tokens) / self.rate)
+
+    def take(self, cost: float = 1):
+        self.tokens -= min(cost, self.capacity)
+
+    def penalize(self, seconds: float):
+        self.tokens = min(self.capacity, 1)
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+# paces telegram sends to stay under its limits: messages per second overall, per second to the same chat and per
+# minute to the same group (negative chat ids). a send waits until every bucket it touches has a token
+class RateLimiter:
+
+    def __init__(self, rate: float = 30, chat_rate: float = 1, group_rate_per_minute: float = 20,
+                 max_chats: int = 10000):
+        self.chat_rate = chat_rate
+        self.group_rate_per_minute = group_rate_per_minute
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(rate, rate)
+        self.chat_buckets: Dict[Hashable, TokenBucket] = dict()
+        self.group_buckets: Dict[Hashable, TokenBucket] = dict()
+        self.sends = 0
+        self.delayed = 0
+        self.waited = 0.0
+        self.flood_waits = 0
+
+    def _buckets(self, chat_id: Optional[Hashable]) -> List[TokenBucket]:
+        buckets = [self.global_bucket]
+        if chat_id is None:
+            return buckets
+        if len(self.chat_buckets) > self.max_chats:
+            self._forget_idle()
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        buckets.append(self.chat_buckets[chat_id])
+        if isinstance(chat_id, int) and chat_id < 0:
+            if chat_id not in self.group_buckets:
+                self.group_buckets[chat_id] = TokenBucket(self.group_rate_per_minute / 60, self.group_rate_per_minute)
+            buckets.append(self.group_buckets[chat_id])
+        return buckets
+
+    def _forget_idle(self):
+        for buckets in (self.chat_buckets, self.group_buckets):
+            for chat_id in [chat_id for chat_id, bucket in buckets.items() if bucket.is_idle()]:
+                del buckets[chat_id]
+
+    async def acquire(self, chat_id: Optional[Hashable] = None, cost: int = 1):
+        delayed = False
+        while True:
+            buckets = self._buckets(chat_id)
+            delay = max(bucket.delay(cost) for bucket in buckets)
+            if delay <= 0:
+                for bucket in buckets:
+                    bucket.take(cost)
+                self.sends += 1
+                self.delayed += delayed
+                return
+            delayed = True
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def penalize(self, chat_id: Optional[Hashable], seconds: float):
+        self.flood_waits += 1
+        buckets = self._buckets(chat_id)
+        # the global bucket is only held back when the wait is not tied to a chat
+        for bucket in buckets[1:] or buckets:
+            bucket.penalize(seconds)
+
+    def stats(self):
+        return {
+            "sends": self.sends,
+            "delayed": self.delayed,
+            "waited_seconds": round(self.waited, 3),
+            "flood_waits": self.flood_waits,
+            "chats": len(self.chat_buckets),
+            "groups": len(self.group_buckets),
+        }
+
+
+rate_limiter = RateLimiter(
+    rate=float(os.environ.get('TELEGRAM_RATE', 30)),
+    chat_rate=float(os.environ.get('TELEGRAM_CHAT_RATE', 1)),
+    group_rate_per_minute=float(os.environ.get('TELEGRAM_GROUP_RATE_PER_MINUTE', 20)),
+)
+
+
+def flood_wait_seconds(err: pyrogram.errors.RPCError) -> float:
+    return getattr(err, 'value', None) or getattr(err, 'x', 0)
+
+
+# waits for the rate limiter before every attempt, and retries an async awaitable as long as it raises FloodWait.
+# the chat is the first argument or chat_id, an album (a list as second argument) costs one token per message
 def retry_on_flood(function: Callable[[Any], Awaitable]):
     async def wrapper(*args, **kwargs):
+        chat_id = kwargs.get('chat_id', args[0] if args else None)
+        media = kwargs.get('media', args[1] if len(args) > 1 else None)
+        cost = len(media) if isinstance(media, list) and media else 1
         while True:
+            await rate_limiter.acquire(chat_id, cost)
             try:
                 return await function(*args, **kwargs)
             except pyrogram.errors.FloodWait as err:
-                print(f'FloodWait, waiting {err.x} seconds')
-                await asyncio.sleep(err.x)
+                print(f'FloodWait, waiting {flood_wait_seconds(err)} seconds')
+                rate_limiter.penalize(chat_id, flood_wait_seconds(err))
                 continue
             except pyrogram.errors.RPCError as err:
                 if err.MESSAGE == 'FloodWait':
-                    await asyncio.sleep(err.x)
+                    rate_limiter.penalize(chat_id, flood_wait_seconds(err))
                     continue
                 else:
                     raise err
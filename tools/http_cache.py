@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+
+@dataclass
+class Revalidation:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    value: Any
+
+    def headers(self) -> Dict[str, str]:
+        headers = dict()
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+# keeps the validators of parsed pages so they can be requested conditionally,
+# a 304 answer then reuses the stored parse result instead of parsing the page again
+class RevalidationCache:
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.revalidated = 0
+        self.refetched = 0
+        self._entries: OrderedDict[Tuple, Revalidation] = OrderedDict()
+
+    def get(self, key: Tuple) -> Optional[Revalidation]:
+        entry = self._entries.get(key)
+        if entry:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Tuple, response, value):
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = Revalidation(etag, last_modified, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "revalidated": self.revalidated,
+            "refetched": self.refetched,
+        }
+
+
+revalidation_cache = RevalidationCache()
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional, Set
+
+from .scheduler import Priority
+
+
+@dataclass
+class Job:
+    user: Hashable
+    priority: int
+    func: Callable[[], Awaitable]
+    group: Optional[Hashable]
+    future: asyncio.Future
+    submitted: float = field(default_factory=time.monotonic)
+
+
+# runs bot work (chapter deliveries) on a bounded number of workers. waiting jobs are served by priority
+# (lower value first), and within a priority round robin between users. a user has at most one job running
+# at a time, so one user queueing a whole manga does not hold back everyone else
+class JobQueue:
+
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._queues: Dict[int, "OrderedDict[Hashable, Deque[Job]]"] = {int(p): OrderedDict() for p in Priority}
+        self._running: Dict[asyncio.Task, Job] = dict()
+        self._running_users: Set[Hashable] = set()
+        self._waits: Dict[int, Deque[float]] = {int(p): deque(maxlen=256) for p in Priority}
+
+    def submit(self, user: Hashable, func: Callable[[], Awaitable], priority: int = Priority.INTERACTIVE,
+               group: Hashable = None) -> asyncio.Future:
+        job = Job(user, int(priority), func, group, asyncio.get_running_loop().create_future())
+        self._queues[job.priority].setdefault(user, deque()).append(job)
+        self._wake_up()
+        return job.future
+
+    async def run(self, user: Hashable, func: Callable[[], Awaitable], priority: int = Priority.INTERACTIVE,
+                  group: Hashable = None):
+        return await self.submit(user, func, priority, group)
+
+    def _next_job(self) -> Optional[Job]:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            for user in list(users):
+                if user in self._running_users:
+                    continue
+                jobs = users.pop(user)
+                while jobs and jobs[0].future.done():
+                    jobs.popleft()
+                if not jobs:
+                    continue
+                job = jobs.popleft()
+                # the user goes to the back of the line for its next job
+                if jobs:
+                    users[user] = jobs
+                return job
+        return None
+
+    def _wake_up(self):
+        while len(self._running) < self.workers:
+            job = self._next_job()
+            if job is None:
+                return
+            self._waits[job.priority].append(time.monotonic() - job.submitted)
+            self._running_users.add(job.user)
+            task = asyncio.ensure_future(job.func())
+            self._running[task] = job
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        job = self._running.pop(task)
+        self._running_users.discard(job.user)
+        if task.cancelled():
+            self.cancelled += 1
+            job.future.cancel()
+        elif task.exception() is not None:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(task.exception())
+        else:
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(task.result())
+        self._wake_up()
+
+    # cancels the waiting jobs of a group, and the running ones too if running is set
+    def cancel_group(self, group: Hashable, running: bool = False) -> int:
+        cancelled = 0
+        for users in self._queues.values():
+            for jobs in users.values():
+                for job in jobs:
+                    if job.group == group and job.future.cancel():
+                        cancelled += 1
+        self.cancelled += cancelled
+        if running:
+            for task, job in self._running.items():
+                if job.group == group and task.cancel():
+                    cancelled += 1
+        return cancelled
+
+    def stats(self):
+        queued = {Priority(priority).name.lower(): sum(not job.future.done() for jobs in users.values() for job in jobs)
+                  for priority, users in self._queues.items()}
+        waits = {Priority(priority).name.lower(): {
+            "average": sum(times) / len(times) if times else 0,
+            "max": max(times, default=0),
+        } for priority, times in self._waits.items()}
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "queued": queued,
+            "wait_seconds": waits,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
+
+
+job_queue = JobQueue(workers=int(os.environ.get('JOB_WORKERS', 4)))
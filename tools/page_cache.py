@@ -0,0 +1,158 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+# persistent on-disk store for downloaded pages and covers, addressed by the hash of the request.
+# entries are kept in least recently used order and the oldest ones are evicted once the byte budget is exceeded
+class PageCache:
+
+    def __init__(self, folder: str = 'page_cache', max_bytes: int = 2 << 30, save_delay: float = 10):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.save_delay = save_delay
+        self.index_path = self.folder / 'index.json'
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        self._loaded = False
+
+    @staticmethod
+    def key(url: str, method: str = 'get', data=None) -> str:
+        raw = f'{method.upper()} {url}'
+        if data:
+            raw += ' ' + json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.folder / key[:2] / key
+
+    # the index is read on first use rather than on import: conversion workers import this module too, and must
+    # neither clean up blobs the bot is writing nor save an index of their own at exit
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._loaded = True
+            self._load()
+            atexit.register(self.save)
+
+    def __contains__(self, key: str):
+        self._ensure_loaded()
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[Path]:
+        self._ensure_loaded()
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        path = self.path(key)
+        if not path.exists():
+            self.size -= self._entries.pop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self._schedule_save()
+        return path
+
+    # registers a blob that was just written to self.path(key)
+    def add(self, key: str):
+        self._ensure_loaded()
+        size = self.path(key).stat().st_size
+        self.size += size - self._entries.get(key, 0)
+        self._entries[key] = size
+        self._entries.move_to_end(key)
+        self._evict()
+        self._schedule_save()
+
+    # makes the blob for key available at dest without copying it when possible
+    def link(self, key: str, dest: Path):
+        os.makedirs(dest.parent, exist_ok=True)
+        if dest.exists():
+            return
+        try:
+            os.link(self.path(key), dest)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(self.path(key), dest)
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def _load(self):
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (FileNotFoundError, ValueError):
+            index = []
+        for key, size in index:
+            if self.path(key).exists():
+                self._entries[key] = size
+                self.size += size
+        # blobs written after the last index save are kept as the least recently used ones
+        for blob in self.folder.glob('??/*'):
+            if blob.name.startswith('.'):
+                os.remove(blob)
+            elif blob.name not in self._entries:
+                size = blob.stat().st_size
+                self._entries[blob.name] = size
+                self._entries.move_to_end(blob.name, last=False)
+                self.size += size
+        self._evict()
+
+    def _schedule_save(self):
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.save()
+        self._save_handle = loop.call_later(self.save_delay, self._save_in_background)
+
+    def _save_in_background(self):
+        self._save_handle = None
+        asyncio.ensure_future(asyncio.to_thread(self._write_index, list(self._entries.items())))
+
+    def save(self):
+        if not self._loaded or not self._entries and not self.index_path.exists():
+            return
+        self._write_index(list(self._entries.items()))
+
+    def _write_index(self, index):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def stats(self):
+        self._ensure_loaded()
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+page_cache = PageCache(
+    folder=os.environ.get('PAGE_CACHE_DIR', 'page_cache'),
+    max_bytes=int(os.environ.get('PAGE_CACHE_SIZE_MB', 2048)) * (1 << 20),
+)
@@ -0,0 +1,90 @@
+import asyncio
+import datetime as dt
+import random
+from collections import defaultdict
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, FrozenSet, Optional
+
+import aiohttp
+
+site_stats: Dict[str, Dict] = defaultdict(lambda: dict(attempts=0, successes=0, retries=0, failures=0,
+                                                       statuses=defaultdict(int)))
+
+
+class DownloadError(ValueError):
+
+    def __init__(self, site: str, status):
+        super().__init__(f'Download from {site} failed with status {status}')
+        self.site = site
+        self.status = status
+
+
+def retry_after(response) -> Optional[float]:
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((date - dt.datetime.now(dt.timezone.utc)).total_seconds(), 0)
+
+
+# retries an attempt that returns a response while it fails with a transient status or connection error.
+# waits grow exponentially with full jitter, Retry-After is honoured, and no wait may cross the deadline,
+# which counts from the first failure so that time spent queued before the first attempt is not charged
+@dataclass
+class RetryPolicy:
+    attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30
+    deadline: float = 120
+    retry_statuses: FrozenSet[int] = frozenset({408, 425, 429, 500, 502, 503, 504, 520, 521, 522, 524})
+
+    def should_retry(self, status: int):
+        return status in self.retry_statuses
+
+    def backoff(self, attempt: int):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, site: str, attempt_func: Callable[[], Awaitable]):
+        stats = site_stats[site]
+        loop = asyncio.get_running_loop()
+        first_failure = None
+        status = None
+        for attempt in range(self.attempts):
+            stats['attempts'] += 1
+            response = None
+            try:
+                response = await attempt_func()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            else:
+                status = int(response.status)
+                if 200 <= status < 300:
+                    stats['successes'] += 1
+                    return response
+            stats['statuses'][status] += 1
+            if isinstance(status, int) and not self.should_retry(status):
+                break
+            if first_failure is None:
+                first_failure = loop.time()
+            delay = retry_after(response)
+            if delay is None:
+                delay = self.backoff(attempt)
+            if attempt + 1 == self.attempts or loop.time() + delay - first_failure > self.deadline:
+                break
+            stats['retries'] += 1
+            await asyncio.sleep(delay)
+        stats['failures'] += 1
+        raise DownloadError(site, status)
+
+
+def stats():
+    return {site: {**values, 'statuses': dict(values['statuses'])} for site, values in site_stats.items()}
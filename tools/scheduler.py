@@ -0,0 +1,101 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import os
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0
+    SUBSCRIPTION = 1
+    BULK = 2
+
+
+# bounds how many downloads run at once, globally and per host.
+# waiting jobs are served by priority (lower value first), then in arrival order
+class DownloadScheduler:
+
+    def __init__(self, limit: int = 32, limit_per_host: int = 6):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.host_limits: Dict[str, int] = dict()
+        self._in_flight = 0
+        self._in_flight_per_host: Dict[str, int] = defaultdict(int)
+        self._queue: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    def set_host_limit(self, host: str, limit: int):
+        if self.host_limits.get(host) != limit:
+            self.host_limits[host] = limit
+            self._wake_up()
+
+    def _host_limit(self, host: str):
+        return self.host_limits.get(host, self.limit_per_host)
+
+    def _can_start(self, host: str):
+        return self._in_flight < self.limit and self._in_flight_per_host[host] < self._host_limit(host)
+
+    def _start(self, host: str):
+        self._in_flight += 1
+        self._in_flight_per_host[host] += 1
+
+    def _release(self, host: str):
+        self._in_flight -= 1
+        self._in_flight_per_host[host] -= 1
+        if not self._in_flight_per_host[host]:
+            del self._in_flight_per_host[host]
+        self._wake_up()
+
+    def _wake_up(self):
+        blocked = []
+        while self._queue and self._in_flight < self.limit:
+            item = heapq.heappop(self._queue)
+            _, _, host, waiter = item
+            if waiter.done():
+                continue
+            if not self._can_start(host):
+                blocked.append(item)
+                continue
+            self._start(host)
+            waiter.set_result(None)
+        for item in blocked:
+            heapq.heappush(self._queue, item)
+
+    @asynccontextmanager
+    async def slot(self, url: str, priority: int = Priority.INTERACTIVE, limit_per_host: int = None):
+        host = urlparse(url).netloc
+        if limit_per_host is not None:
+            self.set_host_limit(host, limit_per_host)
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (int(priority), next(self._counter), host, waiter))
+        self._wake_up()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(host)
+            raise
+        try:
+            yield
+        finally:
+            self._release(host)
+
+    def stats(self):
+        return {
+            "queued": sum(1 for *_, waiter in self._queue if not waiter.done()),
+            "in_flight": self._in_flight,
+            "in_flight_per_host": dict(self._in_flight_per_host),
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "host_limits": dict(self.host_limits),
+        }
+
+
+download_scheduler = DownloadScheduler(
+    limit=int(os.environ.get('DOWNLOAD_LIMIT', 32)),
+    limit_per_host=int(os.environ.get('DOWNLOAD_LIMIT_PER_HOST', 6)),
+)
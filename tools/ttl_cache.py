@@ -0,0 +1,66 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+
+from .singleflight import SingleFlight
+
+T = TypeVar("T")
+
+
+# bounded cache of awaited results. entries younger than ttl are served as they are, entries younger
+# than ttl + stale are still served but refreshed in the background, older entries are fetched again
+class TTLCache:
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 600, stale: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale = stale
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._flight = SingleFlight()
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[T]],
+                           ttl: Optional[float] = None, stale: Optional[float] = None) -> T:
+        ttl = self.ttl if ttl is None else ttl
+        stale = self.stale if stale is None else stale
+        entry = self._entries.get(key)
+        if entry:
+            value, created = entry
+            age = time.monotonic() - created
+            if age < ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            if age < ttl + stale:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                if key not in self._flight:
+                    asyncio.ensure_future(self._refresh(key, fetch))
+                return value
+        self.misses += 1
+        return await self._fetch(key, fetch)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        value = await self._flight.do(key, fetch)
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    async def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable]):
+        try:
+            await self._fetch(key, fetch)
+        except Exception as e:
+            print(f'Error refreshing cached value for {key}: {e}')
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
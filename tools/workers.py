@@ -0,0 +1,73 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+# runs cpu bound conversions (pdf, cbz, thumbnails) in worker processes so the event loop stays responsive.
+# cancelling or timing out a job that has not started yet removes it from the pool, a job that is already
+# running finishes in its worker and its result is discarded. workers are started from a fork server (spawned where
+# there is none) rather than forked from the bot, which has threads running by the time the pool is first used
+class ConversionPool:
+
+    def __init__(self, workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.workers = workers
+        self.timeout = timeout
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(method))
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args, timeout: Optional[float] = None) -> T:
+        timeout = self.timeout if timeout is None else timeout
+        future = asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        self.in_flight += 1
+        try:
+            result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        except BrokenProcessPool:
+            self.failed += 1
+            self._executor = None
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "workers": self.workers or os.cpu_count(),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+        }
+
+
+conversion_pool = ConversionPool(
+    workers=int(os.environ.get('CONVERT_WORKERS', 0)) or None,
+    timeout=float(os.environ.get('CONVERT_TIMEOUT', 600)),
+)